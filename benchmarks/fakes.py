@@ -0,0 +1,43 @@
+import asyncio
+from collections import deque
+
+# In-memory stand-ins for websocket connections, so benchmarks measure the
+# servers' own code and not the network stack. They support what the game
+# and master handlers use: `async for` over incoming messages, send(),
+# close() and remote_address.
+
+
+class FakeWebSocket:
+    def __init__(self, messages=(), hold=False):
+        self.incoming = deque(messages)
+        self.hold = hold # keep the connection open once the messages run out
+        self.more = asyncio.Event()
+        self.sent = 0 # frames
+        self.sent_bytes = 0
+        self.last_sent = None
+        self.closed = False
+        self.remote_address = ("127.0.0.1", 0)
+
+    def feed(self, *messages):
+        self.incoming.extend(messages)
+        self.more.set()
+
+    async def send(self, frame):
+        self.sent += 1
+        self.sent_bytes += len(frame)
+        self.last_sent = frame
+
+    async def close(self, code=1000, reason=""):
+        self.closed = True
+        self.more.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.incoming:
+            if self.closed or not self.hold:
+                raise StopAsyncIteration
+            self.more.clear()
+            await self.more.wait()
+        return self.incoming.popleft()
@@ -0,0 +1,224 @@
+import asyncio
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "game_server"))
+import game
+import rules
+import wire
+from delta import build_delta
+from session import GameSession
+
+from fakes import FakeWebSocket
+from harness import benchmark
+
+# Game server hot paths: state serialization, broadcast_to_session,
+# broadcast_state, handle_player message dispatch and applying a tick's moves
+# across many sessions. Players are FakeWebSockets joined through the real
+# handle_player, and session tick loops are stopped so the only work is the
+# benchmark's own.
+
+PLAYERS = 16
+MESSAGES = 1000 # per handle_player call in the dispatch benchmark
+AOI_PLAYERS = 200
+MOVE_SESSIONS = 500 # sessions of 4 players in the tick_moves benchmarks
+
+_saved = {name: getattr(game, name) for name in ("AOI_RADIUS", "INPUT_RATE", "INPUT_BURST")} # restored by reset()
+_handlers = []
+
+
+async def make_session(match_id, players, map_name="arena", codec=wire.BINARY):
+    # A session with `players` joined connections that stay open until reset()
+    session = game.start_session(match_id, game.initialize_game_state(map_name), game.MATCH_DURATION)
+    game.stop_session_ticks(session)
+    for i in range(players):
+        ws = FakeWebSocket([json.dumps({"type": "join", "username": f"p{i}", "codecs": [codec]})], hold=True)
+        _handlers.append(asyncio.create_task(game.handle_player(ws, f"/game/{match_id}")))
+        # One at a time, letting the outboxes drain each join's broadcasts
+        while f"p{i}" not in session.players:
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+    return session
+
+def scatter(session, seed=1):
+    # Random positions so deltas and AOI queries see a realistic spread
+    rng = random.Random(seed)
+    board = session.state.grid
+    for pid in session.state.players:
+        session.state.move_player(pid, (rng.randrange(board.width), rng.randrange(board.height)))
+    session.tracker.commit()
+
+def step_all(session, rng):
+    # Every player takes one step, as in a busy tick
+    for pid in session.state.players:
+        game.apply_input(session, pid, rng.choice(wire.DIRECTIONS))
+
+def ack_all(session):
+    for pid in session.players:
+        session.acked[pid] = session.tracker.version
+
+async def reset():
+    for session in list(game.game_sessions.values()):
+        for ws in list(session.players.values()):
+            await ws.close()
+    await asyncio.gather(*_handlers)
+    _handlers.clear()
+    for match_id, session in list(game.game_sessions.items()):
+        game.close_session(match_id, session, "benchmark")
+    for name, value in _saved.items():
+        setattr(game, name, value)
+
+
+# --- Serialization ---------------------------------------------------------
+
+def _serialize_keyframe(codec):
+    async def setup():
+        session = await make_session(f"keyframe-{codec}", PLAYERS)
+        scatter(session)
+        message = session.keyframe_message()
+        async def op():
+            wire.encode(message, codec)
+        return op
+    return setup
+
+def _serialize_delta(codec):
+    async def setup():
+        session = await make_session(f"delta-{codec}", PLAYERS)
+        scatter(session)
+        base = session.tracker.version
+        step_all(session, random.Random(2))
+        version = session.tracker.commit()
+        paths = session.tracker.delta_since(base)
+        async def op():
+            changes, removed = build_delta(session.state, paths)
+            wire.encode({"type": "game_state", "version": version, "base": base,
+                         "changes": changes, "removed": removed}, codec)
+        return op
+    return setup
+
+for _codec in wire.SUPPORTED:
+    benchmark(f"serialize.keyframe.{_codec}", cleanup=reset)(_serialize_keyframe(_codec))
+    benchmark(f"serialize.delta.{_codec}", cleanup=reset)(_serialize_delta(_codec))
+
+
+# --- Broadcasts ------------------------------------------------------------
+
+@benchmark("game.broadcast_to_session", cleanup=reset)
+async def broadcast_to_session():
+    # One player_event to every player, drained to the sockets
+    session = await make_session("broadcast-event", PLAYERS)
+    message = {"type": "player_event", "event": "player_joined", "player_id": "p0"}
+    async def op():
+        await game.broadcast_to_session(session.match_id, message)
+        await asyncio.sleep(0)
+    return op
+
+@benchmark("game.broadcast_state.delta", cleanup=reset)
+async def broadcast_state_delta():
+    # A tick where every player moved: commit, one delta per acked version, drain
+    session = await make_session("broadcast-delta", PLAYERS)
+    scatter(session)
+    ack_all(session)
+    rng = random.Random(3)
+    async def op():
+        step_all(session, rng)
+        await game.broadcast_state(session.match_id, session)
+        ack_all(session)
+        await asyncio.sleep(0)
+    return op
+
+@benchmark("game.broadcast_state.keyframe", cleanup=reset)
+async def broadcast_state_keyframe():
+    session = await make_session("broadcast-keyframe", PLAYERS)
+    scatter(session)
+    rng = random.Random(4)
+    async def op():
+        step_all(session, rng)
+        await game.broadcast_state(session.match_id, session, keyframe=True)
+        await asyncio.sleep(0)
+    return op
+
+@benchmark("game.broadcast_state.aoi", cleanup=reset)
+async def broadcast_state_aoi():
+    # A crowded large map with area-of-interest filtering: per-player frames
+    game.AOI_RADIUS = 8
+    session = await make_session("broadcast-aoi", AOI_PLAYERS, map_name="expanse")
+    scatter(session)
+    await game.broadcast_state(session.match_id, session, keyframe=True)
+    ack_all(session)
+    rng = random.Random(5)
+    async def op():
+        step_all(session, rng)
+        await game.broadcast_state(session.match_id, session)
+        ack_all(session)
+        await asyncio.sleep(0)
+    return op
+
+
+# --- Message dispatch ------------------------------------------------------
+
+@benchmark("game.handle_player.dispatch", ops=MESSAGES + 1, cleanup=reset)
+async def handle_player_dispatch():
+    # One connection's join followed by MESSAGES moves and acks (bin1), per message
+    game.INPUT_RATE = game.INPUT_BURST = 10 ** 9 # measure dispatch, not the rate limiter's drops
+    session = await make_session("dispatch", 1)
+    join = json.dumps({"type": "join", "username": "dispatcher", "codecs": [wire.BINARY]})
+    messages = [join]
+    for i in range(MESSAGES):
+        if i % 2:
+            messages.append(wire.encode({"type": "ack", "version": session.tracker.version}, wire.BINARY))
+        else:
+            messages.append(wire.encode({"type": "move", "direction": wire.DIRECTIONS[i // 2 % 4]}, wire.BINARY))
+    path = f"/game/{session.match_id}"
+    async def op():
+        await game.handle_player(FakeWebSocket(messages), path)
+        # Let p0's outbox drain the dispatcher's join and leave broadcasts;
+        # piled up over many calls they would get p0 dropped as a slow consumer
+        while any(outbox.depth for outbox in session.outboxes.values()):
+            await asyncio.sleep(0)
+    return op
+
+
+# --- Tick moves ------------------------------------------------------------
+
+def _move_sessions(rng):
+    # Bare sessions (no connections, no tick loops) with every player moving
+    sessions = []
+    for i in range(MOVE_SESSIONS):
+        session = GameSession(f"moves-{i}", game.initialize_game_state("default"))
+        for p in range(4):
+            session.state.add_player(f"p{p}", rules.spawn_position(session.state))
+        sessions.append(session)
+    def queue_moves():
+        for session in sessions:
+            session.tracker.commit()
+            session.pending_moves = {pid: (rng.choice(wire.DIRECTIONS), None) for pid in session.state.players}
+    return sessions, queue_moves
+
+@benchmark("game.tick_moves.sequential", ops=MOVE_SESSIONS)
+async def tick_moves_sequential():
+    # One tick's moves applied session by session with rules.move(), per session
+    sessions, queue_moves = _move_sessions(random.Random(6))
+    async def op():
+        queue_moves()
+        for session in sessions:
+            for pid, (direction, _) in session.pending_moves.items():
+                game.apply_input(session, pid, direction)
+    return op
+
+@benchmark("game.tick_moves.batch", ops=MOVE_SESSIONS)
+async def tick_moves_batch():
+    # The same through one BatchEngine.step() (BATCH_ENGINE), per session
+    import engine
+    if not engine.available():
+        raise ImportError("numpy is not installed")
+    batch = engine.BatchEngine()
+    sessions, queue_moves = _move_sessions(random.Random(6))
+    for session in sessions:
+        batch.attach(session.state)
+    async def op():
+        queue_moves()
+        batch.step(sessions)
+    return op
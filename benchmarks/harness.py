@@ -0,0 +1,106 @@
+import asyncio
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+
+# Benchmark registry, timing and baseline comparison (see run.py).
+#
+# A benchmark is an async setup function registered with @benchmark. It
+# returns the async operation to time; `ops` says how many units of work one
+# call is (e.g. messages dispatched), so results are per unit. Timing works
+# like timeit: calls are batched until a batch takes at least min_time, the
+# batch is repeated `repeat` times with the garbage collector off, and the
+# fastest and median batches are kept.
+
+registry = {} # name: (setup, ops, cleanup)
+
+
+def benchmark(name, ops=1, cleanup=None):
+    def register(setup):
+        registry[name] = (setup, ops, cleanup)
+        return setup
+    return register
+
+
+async def _time_batch(op, number):
+    started = time.perf_counter()
+    for _ in range(number):
+        await op()
+    return time.perf_counter() - started
+
+async def measure(op, ops=1, repeat=5, min_time=0.2):
+    """Seconds per unit of work: {"min", "median", "repeats", "number"}."""
+    number = 1
+    while True: # 1, 2, 5, 10, 20, 50, ... calls per batch, like timeit.autorange
+        elapsed = await _time_batch(op, number)
+        if elapsed >= min_time:
+            break
+        number *= 2.5 if str(number)[0] == "2" else 2
+        number = int(number)
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        batches = [await _time_batch(op, number) for _ in range(repeat)]
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    per_op = [elapsed / number / ops for elapsed in batches]
+    return {"min": min(per_op), "median": statistics.median(per_op), "repeats": per_op, "number": number}
+
+
+async def run(names, repeat=5, min_time=0.2, progress=None):
+    """Run the named benchmarks. Returns a results document for save()/compare()."""
+    results = {}
+    skipped = {}
+    for name in names:
+        setup, ops, cleanup = registry[name]
+        try:
+            op = await setup()
+        except ImportError as e:
+            # e.g. the master's Flask dependency is not installed here
+            skipped[name] = str(e)
+            continue
+        try:
+            results[name] = await measure(op, ops, repeat, min_time)
+        finally:
+            if cleanup is not None:
+                await cleanup()
+        if progress:
+            progress(name, results[name])
+    return {
+        "meta": {"python": sys.version.split()[0], "implementation": platform.python_implementation(),
+                 "platform": platform.platform(), "created": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+        "skipped": skipped
+    }
+
+
+def save(document, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def compare(current, baseline, threshold=0.1):
+    """[(name, baseline s/op, current s/op, change)] plus the names slower than 1 + threshold times the baseline.
+
+    Compares the fastest batches, which are the least affected by noise
+    from the rest of the machine.
+    """
+    rows = []
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            rows.append((name, None, result["min"], None))
+            continue
+        change = result["min"] / base["min"] - 1
+        rows.append((name, base["min"], result["min"], change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
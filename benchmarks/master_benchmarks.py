@@ -0,0 +1,50 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "master_server"))
+
+from fakes import FakeWebSocket
+from harness import benchmark
+
+# Master matchmaking hot paths through the real matchmaking_handler: filling
+# the general queue up to a match, and a room from creation to a full match.
+# Each handler call gets a FakeWebSocket carrying that player's messages.
+# master.py is imported in setup, so a missing Flask install skips these
+# instead of failing the whole suite.
+
+
+def _import_master():
+    import master
+    return master
+
+async def reset():
+    master = _import_master()
+    master.rooms.clear()
+    master.matchmaking_queue.clear()
+    master.active_connections.clear()
+
+
+@benchmark("master.matchmaking.queue", ops=4, cleanup=reset)
+async def matchmaking_queue():
+    # MAX_PLAYERS_PER_MATCH players join the general queue; the last one starts the match. Per join.
+    master = _import_master()
+    size = master.MAX_PLAYERS_PER_MATCH
+    joins = [json.dumps({"type": "join_match", "username": f"q{i}"}) for i in range(size)]
+    async def op():
+        for message in joins:
+            await master.matchmaking_handler(FakeWebSocket([message]))
+    return op
+
+@benchmark("master.matchmaking.room", ops=4, cleanup=reset)
+async def matchmaking_room():
+    # A host creates a room and the others join it by code until it is full. Per player.
+    master = _import_master()
+    size = master.MAX_PLAYERS_PER_MATCH
+    create = json.dumps({"type": "create_room", "username": "host", "room_code": "BENCH1"})
+    joins = [json.dumps({"type": "join_match", "username": f"r{i}", "room_code": "BENCH1"}) for i in range(1, size)]
+    async def op():
+        await master.matchmaking_handler(FakeWebSocket([create]))
+        for message in joins:
+            await master.matchmaking_handler(FakeWebSocket([message]))
+    return op
@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import fnmatch
+import logging
+import os
+import sys
+
+import harness
+import game_benchmarks
+import master_benchmarks
+
+# Microbenchmarks for the game server and master hot paths.
+#
+#     python benchmarks/run.py                      # run all, compare with the baseline if there is one
+#     python benchmarks/run.py --save-baseline      # run all and store the results as the new baseline
+#     python benchmarks/run.py "game.*" --output results.json
+#     python benchmarks/run.py --log bench.log      # keep the servers' log output
+#
+# Results are seconds per unit of work (see harness.py). A benchmark more than
+# --threshold slower than the baseline is flagged and the exit status is 1.
+# Baselines are machine specific: record one on the machine you compare on.
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def format_time(seconds):
+    if seconds is None:
+        return "-"
+    for unit, scale in (("s", 1), ("ms", 1e3), ("us", 1e6)):
+        if seconds * scale >= 1:
+            return f"{seconds * scale:.2f} {unit}"
+    return f"{seconds * 1e9:.0f} ns"
+
+def print_result(name, result):
+    print(f"{name:<34} {format_time(result['median']):>10} median {format_time(result['min']):>10} min "
+          f"({result['number']} calls x {len(result['repeats'])})", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the game server and master microbenchmarks")
+    parser.add_argument("patterns", nargs="*", help="only run benchmarks matching these glob patterns")
+    parser.add_argument("--repeat", type=int, default=5, help="timed batches per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per batch")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="flag benchmarks slower than the baseline by more than this fraction")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    parser.add_argument("--log", help="write the servers' warnings and errors to this file (default: discard)")
+    args = parser.parse_args(argv)
+
+    names = [name for name in harness.registry
+             if not args.patterns or any(fnmatch.fnmatch(name, pattern) for pattern in args.patterns)]
+    if args.list:
+        print("\n".join(names))
+        return 0
+
+    # Keep the servers' logging (slow consumers, disconnects, ...) out of the results table
+    handler = logging.FileHandler(args.log) if args.log else logging.NullHandler()
+    logging.basicConfig(level=logging.WARNING, handlers=[handler], force=True)
+
+    document = asyncio.run(harness.run(names, args.repeat, args.min_time, print_result))
+    for name, reason in document["skipped"].items():
+        print(f"{name:<34} skipped: {reason}")
+    if args.output:
+        harness.save(document, args.output)
+    if args.save_baseline:
+        harness.save(document, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+
+    rows, regressions = harness.compare(document, harness.load(args.baseline), args.threshold)
+    print(f"\nCompared with {args.baseline} (fastest batches, threshold {args.threshold:+.0%}):")
+    for name, base, current, change in rows:
+        flag = "  REGRESSION" if name in regressions else ""
+        change_text = f"{change:+.1%}" if change is not None else "new"
+        print(f"{name:<34} {format_time(base):>10} -> {format_time(current):>10} {change_text:>8}{flag}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,24 +2,20 @@ import tkinter as tk
 from tkinter import messagebox, ttk
 import requests
 import asyncio
+import base64
 import threading
 import json
+import logging
 import websockets
 import traceback
 import uuid
 import sys
 import os
+import time
+from urllib.parse import urlsplit
+import wire
 
 # Server configuration - can be set via environment variables
-<<<<<<< HEAD
-SERVER_HOST = os.environ.get("SERVER_HOST", "localhost")  # Change this to your cloud server's IP/domain
-SERVER_HTTP_PORT = os.environ.get("SERVER_HTTP_PORT", "5000")
-SERVER_WS_PORT = os.environ.get("SERVER_WS_PORT", "8765")
-
-# API endpoints
-MASTER_API = f"http://192.168.213.236:5000"
-MATCHMAKING_WS = f"ws://192.168.213.236:8765"
-=======
 SERVER_HOST = os.environ.get("SERVER_HOST", "localhost")
 SERVER_HTTP_PORT = os.environ.get("SERVER_HTTP_PORT", "5000")
 SERVER_WS_PORT = os.environ.get("SERVER_WS_PORT", "8765")
@@ -29,27 +25,78 @@ GAME_SERVER_PORT = os.environ.get("GAME_SERVER_PORT", "9001")
 MASTER_API = f"http://{SERVER_HOST}:{SERVER_HTTP_PORT}"
 MATCHMAKING_WS = f"ws://{SERVER_HOST}:{SERVER_WS_PORT}"
 GAME_SERVER_WS = f"ws://{SERVER_HOST}:{GAME_SERVER_PORT}"
->>>>>>> 1c9a33f (reverting changes)
+# A game server that restarts closes connections with 1012 and restores the
+# match in the new process; the client rejoins this many times before giving up
+RECONNECT_ATTEMPTS = int(os.environ.get("RECONNECT_ATTEMPTS", 10))
+RECONNECT_CODES = (1012, 1013) # service restart, try again later
+
+# Per-message logging is DEBUG; set LOG_LEVEL=DEBUG to see every received state
+logger = logging.getLogger("client")
 
 def debug_print(*args, **kwargs):
     print("[DEBUG]", *args, **kwargs)
     sys.stdout.flush()
 
+# Board cell codes (game_server/board.py)
+CELL_EMPTY = 0
+CELL_GEM = 1
+CELL_WALL = 2
+
+_REMOVED = object()
+
+def set_path(state, path, value):
+    # Returns a copy of `state` with `path` set to `value` (or deleted for
+    # _REMOVED). Containers along the path are copied, not mutated, so a state
+    # already handed to the UI thread never changes underneath it.
+    if not path:
+        return value
+    key, rest = path[0], path[1:]
+    if isinstance(state, (list, bytearray)):
+        node = state.copy()
+        if value is _REMOVED and not rest:
+            del node[key]
+        else:
+            node[key] = set_path(node[key], rest, value)
+        return node
+    node = dict(state) if isinstance(state, dict) else {}
+    if value is _REMOVED:
+        if key in node:
+            if rest:
+                node[key] = set_path(node[key], rest, value)
+            else:
+                del node[key]
+        return node
+    node[key] = set_path(node.get(key), rest, value)
+    return node
+
+# Must match MOVES in game_server/rules.py
+MOVES = {"up": (0, -1), "down": (0, 1), "left": (-1, 0), "right": (1, 0)}
+
+def predict(state, player_id, moves):
+    # Replays our moves the server has not processed yet on top of its state,
+    # with the movement rules of game_server/rules.py: one cell per move,
+    # staying on the board and out of walls and other players' cells. Gems
+    # and scores are left to the server.
+    player = state["players"].get(player_id)
+    if player is None or not moves or state.get("game_over"):
+        return state
+    grid = state["grid"]
+    width, height, cells = grid["w"], grid["h"], grid["cells"]
+    occupied = {tuple(other["position"]) for pid, other in state["players"].items() if pid != player_id}
+    x, y = player["position"]
+    for _, direction in moves:
+        dx, dy = MOVES[direction]
+        nx, ny = x + dx, y + dy
+        if 0 <= nx < width and 0 <= ny < height and cells[ny * width + nx] != CELL_WALL and (nx, ny) not in occupied:
+            x, y = nx, ny
+    return set_path(state, ["players", player_id, "position"], [x, y])
+
 class GameClientApp:
     def __init__(self, root):
         self.root = root
-<<<<<<< HEAD
-        self.root.title("Distributed Game Client")
-        
-        # Add server connection info
-        debug_print(f"Connecting to server at {MASTER_API}")
-        debug_print(f"WebSocket endpoint at {MATCHMAKING_WS}")
-        
-=======
         self.root.title("Gem Hunt")
         
         # Game state
->>>>>>> 1c9a33f (reverting changes)
         self.username = None
         self.match_info = None
         self.room_code = None
@@ -57,6 +104,18 @@ class GameClientApp:
         self.matchmaking_active = False
         self.websocket = None
         self.game_state = None
+        self.state_version = None # Version of self.game_state, acked back to the server
+        self.codec = wire.JSON # Game server wire codec, negotiated in join
+        self.resume_token = None # From the last join_ack; rejoining with it resumes from state_version
+        self.game_loop = None # Event loop of the game connection thread
+        # Client-side prediction, all on the Tk thread: our moves are drawn as
+        # soon as they are sent and replayed on top of each server state until
+        # the server reports their sequence number as processed
+        self.server_state = None # Last state received, before prediction
+        self.move_seq = 0 # Sequence number of our last move
+        self.unacked_moves = [] # (seq, direction) not yet processed by the server
+        self.move_interval = 0 # One move per server tick; faster ones would be coalesced
+        self.last_move_at = 0
         self.running = False
         
         # Verify server connection before starting
@@ -509,60 +568,162 @@ class GameClientApp:
     def connect_to_game(self):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
+        self.game_loop = loop
         try:
             loop.run_until_complete(self._connect_to_game())
         finally:
             loop.close()
 
     async def _connect_to_game(self):
-        try:
-            # Fix the URL format - remove the extra /game/ part as it's already in the path
-            game_server_url = f"{GAME_SERVER_WS}/game/{self.match_info['match_id']}"
-            print(f"Connecting to game server at: {game_server_url}")
-            self.websocket = await websockets.connect(game_server_url)
-            await self.websocket.send(json.dumps({
-                "type": "join",
-                "username": self.username
-            }))
-
-            while self.running:
-                message = await self.websocket.recv()
-                data = json.loads(message)
-                
-                if data["type"] == "game_state":
-                    self.root.after(0, lambda: self.update_game_state(data["state"]))
-                elif data["type"] == "error":
-                    self.root.after(0, lambda: messagebox.showerror("Error", data["message"]))
-                    self.running = False
-                    break
+        # A new match; nothing to resume
+        self.game_state = None
+        self.state_version = None
+        self.resume_token = None
+        attempts = 0
+        while True:
+            try:
+                await self._play_game()
+                return
+            except websockets.exceptions.ConnectionClosed as e:
+                code = e.rcvd.code if e.rcvd else None
+                # A connection that just dropped (no close frame) is worth
+                # resuming too, while the server still holds our place
+                dropped = code is None and self.resume_token is not None
+                if not self.running or not (code in RECONNECT_CODES or dropped) or attempts >= RECONNECT_ATTEMPTS:
+                    self._game_connection_error(e)
+                    return
+                attempts += 1
+                print(f"Game connection lost (close code {code}); reconnecting, attempt {attempts}")
+                await asyncio.sleep(0.5 if dropped and attempts == 1 else min(attempts, 5))
+            except OSError as e:
+                # Refused while the server restarts; only retry after a restart close
+                if attempts == 0 or attempts >= RECONNECT_ATTEMPTS:
+                    self._game_connection_error(e)
+                    return
+                attempts += 1
+                await asyncio.sleep(min(attempts, 5))
+            except Exception as e:
+                self._game_connection_error(e)
+                return
+
+    def _game_connection_error(self, e):
+        error_msg = str(e)
+        print(f"Game connection error: {error_msg}")
+        print(traceback.format_exc())
+        self.root.after(0, lambda: messagebox.showerror("Error", f"Game connection error: {error_msg}"))
+        self.running = False
 
-        except Exception as e:
-            error_msg = str(e)
-            print(f"Game connection error: {error_msg}")
-            print(traceback.format_exc())
-            self.root.after(0, lambda: messagebox.showerror("Error", f"Game connection error: {error_msg}"))
-            self.running = False
+    async def _play_game(self):
+        # One connection to the game server. Rejoining the same match_id after a
+        # restart resumes the player's place from the server's snapshot; after
+        # a dropped connection, from the state we still hold.
+        # The master picks the game server worker that owns the match; keep our
+        # configured host (the master may advertise an internal one) but use its
+        # port and path.
+        game_server_url = f"{GAME_SERVER_WS}/game/{self.match_info['match_id']}"
+        advertised = urlsplit(self.match_info.get("game_server") or "")
+        if advertised.port and advertised.path:
+            game_server_url = f"ws://{SERVER_HOST}:{advertised.port}{advertised.path}"
+        print(f"Connecting to game server at: {game_server_url}")
+        self.websocket = await websockets.connect(game_server_url)
+        self.codec = wire.JSON
+        join = {"type": "join", "username": self.username, "codecs": list(wire.SUPPORTED)}
+        if self.resume_token and self.state_version is not None:
+            # The server sends only what changed since the state we still hold
+            # (or a keyframe if it cannot resume us)
+            join["resume"] = self.resume_token
+            join["version"] = self.state_version
+        await self.websocket.send(json.dumps(join))
+
+        while self.running:
+            message = await self.websocket.recv()
+            data = wire.decode(message) # JSON text or bin1 binary frame
+            
+            if data["type"] == "join_ack":
+                self.codec = data.get("codec", wire.JSON)
+                self.resume_token = data.get("resume")
+                self.root.after(0, lambda d=data: self._joined_game(d))
+            elif data["type"] == "game_state":
+                state = await self.apply_game_state(data)
+                if state is not None:
+                    self.root.after(0, lambda s=state: self.update_game_state(s))
+            elif data["type"] == "error":
+                self.root.after(0, lambda: messagebox.showerror("Error", data["message"]))
+                self.running = False
+                break
+
+    async def apply_game_state(self, data):
+        # Keyframes replace the state; deltas carry the paths changed since
+        # `base`, which must not be newer than the version we hold.
+        if data.get("keyframe"):
+            state = data["state"]
+        elif self.game_state is None or data["base"] > self.state_version:
+            await self.websocket.send(json.dumps({"type": "resync"}))
+            return None
+        else:
+            state = self.game_state
+            for path, value in data["changes"]:
+                state = set_path(state, path, value)
+            for path in data["removed"]:
+                state = set_path(state, path, _REMOVED)
+
+        # Board cells arrive as raw bytes (bin1) or base64 (JSON); keep a bytearray
+        grid = state.get("grid")
+        if grid and not isinstance(grid["cells"], bytearray):
+            cells = grid["cells"]
+            if isinstance(cells, str):
+                cells = base64.b64decode(cells)
+            state = set_path(state, ["grid", "cells"], bytearray(cells))
 
-    def send_move(self, direction: str):
-        if self.websocket:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                loop.run_until_complete(self._send_move(direction))
-            finally:
-                loop.close()
+        self.game_state = state
+        self.state_version = data["version"]
+        await self.websocket.send(wire.encode({"type": "ack", "version": self.state_version}, self.codec))
+        return state
+
+    def _joined_game(self, data):
+        # Moves in flight when a previous connection dropped are gone; keep
+        # numbering after the last one the server processed
+        self.move_seq = max(self.move_seq, data.get("seq", 0))
+        self.unacked_moves = []
+        self.server_state = None
+        if data.get("tick_rate"):
+            self.move_interval = 1 / data["tick_rate"]
 
-    async def _send_move(self, direction: str):
+    def send_move(self, direction: str):
+        if not self.websocket or not self.game_loop or not self.running:
+            return
+        now = time.monotonic()
+        if now - self.last_move_at < self.move_interval:
+            return
+        self.last_move_at = now
+        self.move_seq += 1
+        self.unacked_moves.append((self.move_seq, direction))
+        asyncio.run_coroutine_threadsafe(self._send_move(direction, self.move_seq), self.game_loop)
+        if self.server_state is not None:
+            self.draw_game_state(predict(self.server_state, self.username, self.unacked_moves))
+
+    async def _send_move(self, direction: str, seq: int):
         try:
-            await self.websocket.send(json.dumps({
+            await self.websocket.send(wire.encode({
                 "type": "move",
-                "direction": direction
-            }))
+                "direction": direction,
+                "seq": seq
+            }, self.codec))
         except Exception as e:
             print(f"Error sending move: {str(e)}")
             print(traceback.format_exc())
 
     def update_game_state(self, state):
+        # Reconcile: forget our moves the server has processed and replay the
+        # rest on top of its state
+        self.server_state = state
+        me = state["players"].get(self.username)
+        if me is not None:
+            processed = me.get("seq", 0)
+            self.unacked_moves = [move for move in self.unacked_moves if move[0] > processed]
+        self.draw_game_state(predict(state, self.username, self.unacked_moves))
+
+    def draw_game_state(self, state):
         # Update time
         self.time_label.config(text=f"Time: {int(state['time_remaining'])}")
         
@@ -574,29 +735,31 @@ class GameClientApp:
         for widget in self.grid_frame.winfo_children():
             widget.destroy()
             
-        grid = state["grid"]
+        grid = state["grid"] # {"w": width, "h": height, "cells": bytearray, row-major}
+        width, cells = grid["w"], grid["cells"]
         players = state["players"]
         
-        for y in range(len(grid)):
-            for x in range(len(grid[0])):
+        for y in range(grid["h"]):
+            for x in range(width):
                 cell = ttk.Frame(self.grid_frame, width=30, height=30, relief="solid", borderwidth=1)
                 cell.grid(row=y, column=x)
                 
-                if grid[y][x] == 1:
+                if cells[y * width + x] == CELL_GEM:
                     ttk.Label(cell, text="💎").place(relx=0.5, rely=0.5, anchor="center")
                 
                 for player, data in players.items():
-                    if data["position"] == (x, y):
+                    if tuple(data["position"]) == (x, y):
                         ttk.Label(cell, text=player[0].upper()).place(relx=0.5, rely=0.5, anchor="center")
         
         if state.get("game_over"):
-            messagebox.showinfo("Game Over", f"Winner: {state.get('winner')}")
+            winner = state.get("winner")
+            messagebox.showinfo("Game Over", f"Winner: {winner}" if winner else "Game Over! It's a tie!")
             self.running = False
             self.root.quit()
 
     def _update_game_state(self, state):
         """Update the game state display"""
-        print(f"Updating game state: {state}")
+        logger.debug("Updating game state: %s", state)
         self.game_state = state
         
         # Update score labels
@@ -641,7 +804,7 @@ class GameClientApp:
         try:
             async for message in self.ws:
                 data = json.loads(message)
-                print(f"Received message: {data}")
+                logger.debug("Received message: %s", data)
                 
                 if data["type"] == "game_state":
                     # Update game state in the main thread
@@ -668,6 +831,8 @@ class GameClientApp:
                 loop.close()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+                        format="[%(asctime)s] %(levelname)s %(name)s %(message)s")
     root = tk.Tk()
     root.geometry("400x500")
     app = GameClientApp(root)
@@ -0,0 +1,89 @@
+# Compact board storage: one byte per cell, row-major. The cells of a map
+# live once in its MapTemplate (see maps.py) as immutable bytes shared by
+# every session on that map; a session's Board only stores the cells it has
+# changed (e.g. collected gems) in a copy-on-write overlay.
+# On the wire it is {"w": width, "h": height, "map": name, "cells": <packed
+# bytes>}; bin1 sends the bytes as-is and JSON sends them base64 encoded.
+
+EMPTY = 0
+GEM = 1
+WALL = 2
+
+
+class CellOverlay:
+    # Reads fall through to the shared template bytes unless the session has
+    # written that cell. Supports the subset of bytearray the game uses.
+    __slots__ = ("base", "changes")
+
+    def __init__(self, base):
+        self.base = base # bytes, shared and never written
+        self.changes = {} # index: code, only cells that differ from base
+
+    def __len__(self):
+        return len(self.base)
+
+    def __getitem__(self, index):
+        code = self.changes.get(index)
+        return self.base[index] if code is None else code
+
+    def __setitem__(self, index, code):
+        if self.base[index] == code:
+            self.changes.pop(index, None)
+        else:
+            self.base[index] # IndexError for out-of-range writes
+            self.changes[index] = code
+
+    def find(self, code, start=0):
+        # Lowest index >= start holding `code`
+        best = self.base.find(code, start)
+        while best != -1 and best in self.changes:
+            best = self.base.find(code, best + 1)
+        for index, changed in self.changes.items():
+            if changed == code and index >= start and (best == -1 or index < best):
+                best = index
+        return best
+
+    def tobytes(self):
+        if not self.changes:
+            return self.base
+        cells = bytearray(self.base)
+        for index, code in self.changes.items():
+            cells[index] = code
+        return bytes(cells)
+
+
+class Board:
+    __slots__ = ("width", "height", "template", "cells")
+
+    def __init__(self, template):
+        self.template = template
+        self.width = template.width
+        self.height = template.height
+        self.cells = CellOverlay(template.cells)
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def index(self, x, y):
+        return y * self.width + x
+
+    def get(self, x, y):
+        return self.cells[y * self.width + x]
+
+    def set(self, x, y, code):
+        # Returns the cell index so callers can record the change
+        index = y * self.width + x
+        self.cells[index] = code
+        return index
+
+    def positions(self, code):
+        # (x, y) of every cell holding `code`; a scan, so not for per-tick use
+        width = self.width
+        index = self.cells.find(code)
+        while index != -1:
+            yield index % width, index // width
+            index = self.cells.find(code, index + 1)
+
+    def to_wire(self):
+        return {"w": self.width, "h": self.height, "map": self.template.name,
+                "cells": self.cells.tobytes()}
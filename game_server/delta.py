@@ -0,0 +1,92 @@
+from collections import deque
+
+# Versioned change tracking for a session's game state.
+#
+# Instead of diffing snapshots, every mutation of the state records the path
+# it touched ("players", "alice", "position"). commit() stamps the pending
+# paths with a new version, and delta_since(base) returns the paths changed
+# after `base`, which are then read back from the live state. A client that
+# has acked version `base` can apply the resulting changes and end up at the
+# current version. Applying a delta built from an older base is harmless, so
+# several clients at different versions can share one encoded frame per base.
+
+
+class StateTracker:
+    def __init__(self, history=64):
+        self.version = 0
+        self.history = history # how many versions of changes are kept
+        self.log = deque() # (version, [paths]) for the last `history` versions
+        self.pending = set()
+
+    def touch(self, *path):
+        self.pending.add(path)
+
+    def commit(self):
+        """Stamp pending changes with a new version. Returns the current version."""
+        if self.pending:
+            self.version += 1
+            self.log.append((self.version, self.pending))
+            self.pending = set()
+            while len(self.log) > self.history:
+                self.log.popleft()
+        return self.version
+
+    def delta_since(self, base):
+        """Paths changed after version `base`, or None if a keyframe is needed."""
+        if base is None or base > self.version:
+            return None
+        if base == self.version:
+            return []
+        # Oldest version still described by the log; anything older needs a keyframe
+        if not self.log or self.log[0][0] > base + 1:
+            return None
+        paths = set()
+        for version, changed in reversed(self.log):
+            if version <= base:
+                break
+            paths |= changed
+        return collapse_paths(paths)
+
+
+def collapse_paths(paths):
+    # Drop paths that are covered by a shorter changed prefix
+    result = []
+    covered = set()
+    for path in sorted(paths, key=len):
+        if any(path[:i] in covered for i in range(1, len(path))):
+            continue
+        covered.add(path)
+        result.append(path)
+    return result
+
+
+_MISSING = object()
+
+def read_path(state, path):
+    # Paths walk dicts and sequences by key, and string keys on other
+    # objects (e.g. the Board) by attribute name
+    node = state
+    for key in path:
+        if isinstance(node, dict) or not isinstance(key, str):
+            try:
+                node = node[key]
+            except (KeyError, IndexError, TypeError):
+                return _MISSING
+        else:
+            node = getattr(node, key, _MISSING)
+            if node is _MISSING:
+                return _MISSING
+    return node
+
+
+def build_delta(state, paths):
+    """Return (changes, removed) for the given paths of the live state."""
+    changes = []
+    removed = []
+    for path in paths:
+        value = read_path(state, path)
+        if value is _MISSING:
+            removed.append(list(path))
+        else:
+            changes.append([list(path), value])
+    return changes, removed
@@ -0,0 +1,160 @@
+try:
+    import numpy as np
+except ImportError: # Optional; without it BATCH_ENGINE falls back to per-session ticks
+    np = None
+
+from board import EMPTY, GEM, WALL
+import rules
+
+# Batched move resolution for many small sessions (BATCH_ENGINE, see game.py).
+#
+# Every attached session's board cells and occupancy live in two shared
+# arrays, one block of width * height entries per session. GameState keeps
+# them current through its `batch` hooks, so they always mirror the board and
+# GameState.occupants. step() gathers the pending moves of every session due
+# in a tick into one array and resolves bounds, walls, occupancy, contested
+# cells and gems for all of them in one vectorized pass.
+#
+# Results must match rules.move() applied in input order exactly, or replays
+# would diverge. Moves that could interact with another move of the same
+# tick are therefore left to rules.move(), in input order:
+#   - moves into a cell occupied at the start of the tick,
+#   - moves into a cell another move also targets,
+#   - moves out of a cell another move targets.
+# Every other open move is independent of the rest and is applied from the
+# vectorized result. Results are written back through the GameState
+# mutators, so delta tracking and broadcasts work unchanged.
+
+_DIRECTIONS = tuple(rules.MOVES)
+_DIRECTION_CODES = {direction: code for code, direction in enumerate(_DIRECTIONS)}
+
+
+def available():
+    return np is not None
+
+
+class Block:
+    # One session's slice of the shared arrays; GameState.batch
+    __slots__ = ("engine", "offset", "size", "width")
+
+    def __init__(self, engine, offset, size, width):
+        self.engine = engine
+        self.offset = offset
+        self.size = size
+        self.width = width
+
+    def set_cell(self, index, code):
+        self.engine.cells[self.offset + index] = code
+
+    def set_occupied(self, position, occupied):
+        self.engine.occupied[self.offset + position[1] * self.width + position[0]] = occupied
+
+
+class BatchEngine:
+    def __init__(self, capacity=1 << 16):
+        self.cells = np.zeros(capacity, np.uint8)
+        self.occupied = np.zeros(capacity, np.uint8)
+        self.top = 0 # end of the allocated part
+        self.free = {} # block size: [offsets] released by detach()
+        self.dx = np.array([rules.MOVES[d][0] for d in _DIRECTIONS], np.int64)
+        self.dy = np.array([rules.MOVES[d][1] for d in _DIRECTIONS], np.int64)
+
+    def attach(self, state):
+        board = state.grid
+        size = board.width * board.height
+        free = self.free.get(size)
+        if free:
+            offset = free.pop()
+        else:
+            offset = self.top
+            self.top += size
+            if self.top > len(self.cells):
+                capacity = max(self.top, len(self.cells) * 2)
+                self.cells = np.concatenate([self.cells, np.zeros(capacity - len(self.cells), np.uint8)])
+                self.occupied = np.concatenate([self.occupied, np.zeros(capacity - len(self.occupied), np.uint8)])
+        self.cells[offset:offset + size] = np.frombuffer(board.cells.tobytes(), np.uint8)
+        self.occupied[offset:offset + size] = 0
+        block = state.batch = Block(self, offset, size, board.width)
+        for position in state.occupants:
+            block.set_occupied(position, 1)
+
+    def detach(self, state):
+        block = state.batch
+        if block is not None:
+            state.batch = None
+            self.free.setdefault(block.size, []).append(block.offset)
+
+    def step(self, sessions):
+        """Apply the pending moves of `sessions` (not game over, attached) as rules.move() would."""
+        positions = [] # (x, y) per valid move
+        codes = [] # direction code per valid move
+        movers = [] # (state, player_id, direction) per valid move
+        blocks = [] # (block offset, width, height, moves) per session with valid moves
+        last_moves = [] # (state, last_move_by, last_direction, whether each changed) per state with moves
+        for session in sessions:
+            state = session.state
+            block = state.batch
+            if state.game_over or not session.pending_moves:
+                continue
+            players = state.players
+            count = len(movers)
+            # Every valid move sets last_move_by and last_direction in
+            # rules.move(); the path is touched if any of them changed it
+            last_by, last_direction = state.last_move_by, state.last_direction
+            by_changed = direction_changed = False
+            for player_id, (direction, _) in session.pending_moves.items():
+                player = players.get(player_id)
+                code = _DIRECTION_CODES.get(direction) if isinstance(direction, str) else None
+                if player is None or code is None: # rules.move() ignores these
+                    continue
+                positions.append(player.position)
+                codes.append(code)
+                movers.append((state, player_id, direction))
+                if player_id != last_by:
+                    last_by, by_changed = player_id, True
+                if direction != last_direction:
+                    last_direction, direction_changed = direction, True
+            if len(movers) > count:
+                blocks.append((block.offset, state.grid.width, state.grid.height, len(movers) - count))
+            if by_changed or direction_changed:
+                last_moves.append((state, last_by, last_direction, by_changed, direction_changed))
+        if not movers:
+            return
+
+        offset, width, height, count = np.array(blocks, np.int64).T
+        offset, width, height = (np.repeat(column, count) for column in (offset, width, height))
+        x, y = np.array(positions, np.int64).T
+        code = np.array(codes, np.int64)
+        nx = x + self.dx[code]
+        ny = y + self.dy[code]
+        inside = (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+        target = offset + np.where(inside, ny * width + nx, 0)
+        cell = self.cells[target]
+        open_ = inside & (cell != WALL)
+        targets, counts = np.unique(target[open_], return_counts=True)
+        interacting = ((self.occupied[target] != 0)
+                       | np.isin(target, targets[counts > 1])
+                       | np.isin(offset + y * width + x, targets))
+        fast = open_ & ~interacting
+        slow = open_ & interacting
+
+        # Plain lists from here on; indexing numpy arrays one element at a time is slow
+        nx, ny = nx.tolist(), ny.tolist()
+        for i in np.flatnonzero(fast).tolist():
+            movers[i][0].move_player(movers[i][1], (nx[i], ny[i]))
+        for i in np.flatnonzero(fast & (cell == GEM)).tolist():
+            state, player_id, _ = movers[i]
+            state.set_cell(nx[i], ny[i], EMPTY)
+            state.add_score(player_id, rules.GEM_POINTS)
+        for i in np.flatnonzero(slow).tolist():
+            state, player_id, direction = movers[i]
+            rules.move(state, player_id, direction)
+        for state, last_by, last_direction, by_changed, direction_changed in last_moves:
+            # Touched even if the final value equals the old one, as in-order
+            # rules.move() calls would have
+            if by_changed:
+                state.last_move_by = last_by
+                state.tracker.touch("last_move_by")
+            if direction_changed:
+                state.last_direction = last_direction
+                state.tracker.touch("last_direction")
@@ -1,12 +1,159 @@
 import asyncio
+import hmac
+import http
 import json
+import math
+import websockets
 from websockets.server import WebSocketServerProtocol, serve  # Updated import path
-from datetime import datetime, UTC
+from websockets.exceptions import AbortHandshake
+import multiprocessing
 import os
+import secrets
+import signal
+import sys
+import time
+import zlib
+from collections import deque
+from board import Board
+import maps
+from outbox import Outbox
+from ratelimit import TokenBucket
+from delta import build_delta
+import engine
+import interest
+import rules
+from session import GameSession, new_state
+from timers import TimerQueue
+import wire
+import log
+import snapshot
+from replay import ReplayLog
+import metrics
 # import weakref # REMOVE THIS
 
 # Server configuration
 GAME_SERVER_PORT = int(os.environ.get("GAME_PORT", 9001))
+# Simulation ticks per second for every session. Inputs are queued between
+# ticks and applied once per tick, and each tick broadcasts at most once.
+TICK_RATE = int(os.environ.get("TICK_RATE", 20))
+# Sessions tick on a shared grid split into TICK_PHASES evenly spaced phases;
+# each new session takes the least used phase so broadcasts do not all land
+# at the same instant.
+TICK_PHASES = int(os.environ.get("TICK_PHASES", 8))
+# A session with no join or move for IDLE_TICK_AFTER seconds drops to
+# IDLE_TICK_RATE ticks per second (on the same phase) until the next input.
+IDLE_TICK_AFTER = float(os.environ.get("IDLE_TICK_AFTER", 5))
+IDLE_TICK_RATE = float(os.environ.get("IDLE_TICK_RATE", 2))
+# With BATCH_ENGINE=1 one loop per tick phase ticks all of that phase's
+# sessions and resolves their moves together in one vectorized pass (see
+# engine.py), instead of one loop per session. Needs numpy; without it the
+# server logs a warning and ticks per session.
+BATCH_ENGINE = int(os.environ.get("BATCH_ENGINE", 0))
+# game_state frames are deltas against each client's last acked version; a full
+# keyframe goes out on join, on resync and at least every KEYFRAME_INTERVAL ticks.
+KEYFRAME_INTERVAL = int(os.environ.get("KEYFRAME_INTERVAL", 200))
+DELTA_HISTORY = int(os.environ.get("DELTA_HISTORY", 64)) # versions a delta can span
+# With AOI_RADIUS > 0 each player is only sent the players and board cell
+# changes within that many cells of their position (see interest.py); 0 sends
+# everyone everything.
+AOI_RADIUS = int(os.environ.get("AOI_RADIUS", 0))
+# Every connection gets its own bounded send queue (see outbox.py). A client
+# that stays over MAX_SEND_QUEUE queued frames for SLOW_CONSUMER_TIMEOUT
+# seconds is disconnected.
+MAX_SEND_QUEUE = int(os.environ.get("MAX_SEND_QUEUE", 32))
+SLOW_CONSUMER_TIMEOUT = float(os.environ.get("SLOW_CONSUMER_TIMEOUT", 5))
+# Per-player input limits: moves and resyncs spend tokens from a bucket that
+# refills at INPUT_RATE per second up to INPUT_BURST. Excess messages are
+# dropped and counted, and only a player's last move in each tick is applied.
+INPUT_RATE = float(os.environ.get("INPUT_RATE", 30))
+INPUT_BURST = int(os.environ.get("INPUT_BURST", 10))
+# With GAME_WORKERS > 1, game.py runs as a supervisor for that many worker
+# processes. Worker i listens on GAME_PORT + i and owns the match IDs that
+# shard_for_match() maps to i; master.py routes players with the same function.
+GAME_WORKERS = int(os.environ.get("GAME_WORKERS", 1))
+# Map templates are built/loaded once per process and shared by every session
+# (see maps.py). BOARD_WIDTH/BOARD_HEIGHT size the built-in "default" map and
+# MAPS_DIR can point at a directory of extra *.json maps.
+BOARD_WIDTH = int(os.environ.get("BOARD_WIDTH", 10))
+BOARD_HEIGHT = int(os.environ.get("BOARD_HEIGHT", 10))
+DEFAULT_MAP = os.environ.get("DEFAULT_MAP", "default")
+MAPS_DIR = os.environ.get("MAPS_DIR")
+# Session lifetime (all driven by one timer heap, see timers.py). A player
+# who disconnects keeps their place for RECONNECT_GRACE seconds; a player who
+# sends no input for IDLE_TIMEOUT seconds is disconnected (0 disables); a
+# session with nobody connected is closed after EMPTY_SESSION_TIMEOUT seconds.
+MATCH_DURATION = int(os.environ.get("MATCH_DURATION", 60))
+RECONNECT_GRACE = float(os.environ.get("RECONNECT_GRACE", 10))
+IDLE_TIMEOUT = float(os.environ.get("IDLE_TIMEOUT", 120))
+EMPTY_SESSION_TIMEOUT = float(os.environ.get("EMPTY_SESSION_TIMEOUT", 30))
+# On SIGTERM the server drains: it stops taking new matches, snapshots every
+# live match to SNAPSHOT_DIR (if set) and asks clients to reconnect. The next
+# process on the same port restores those matches on startup and holds each
+# player's place for RESTORE_GRACE seconds. See snapshot.py.
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR")
+RESTORE_GRACE = float(os.environ.get("RESTORE_GRACE", 30))
+# With REPLAY_DIR set every match is recorded to an append-only replay log
+# there (see replay.py and replay_tool.py), flushed every REPLAY_FLUSH_INTERVAL
+# seconds by a background thread.
+REPLAY_DIR = os.environ.get("REPLAY_DIR")
+REPLAY_FLUSH_INTERVAL = float(os.environ.get("REPLAY_FLUSH_INTERVAL", 1))
+# With CONTROL_TOKEN set the master pre-registers every match over the
+# CONTROL_PATH websocket (authenticating with the token): the session is
+# created then, connections for unregistered matches are refused at the
+# handshake and only the registered usernames may join. Match results are
+# reported back over the same channel. Unset, any /game/<match_id> creates
+# its session on first connection.
+CONTROL_TOKEN = os.environ.get("CONTROL_TOKEN")
+CONTROL_PATH = "/control"
+# Admission control per process; 0 means no limit. Past MAX_SESSIONS or
+# MAX_CONNECTIONS new arrivals get HTTP 503 at the handshake, before any
+# per-connection state exists, so running matches keep their capacity. With
+# MAX_HANDSHAKES opening handshakes already in progress the next one gets a
+# 503 before its request is read. Frames over MAX_MESSAGE_SIZE bytes close
+# the connection (1009). With CONTROL_TOKEN the remaining headroom is sent to
+# the master every CAPACITY_REPORT_INTERVAL seconds, so it can place new
+# matches on other workers.
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 0))
+MAX_CONNECTIONS = int(os.environ.get("MAX_CONNECTIONS", 0))
+MAX_HANDSHAKES = int(os.environ.get("MAX_HANDSHAKES", 0))
+MAX_MESSAGE_SIZE = int(os.environ.get("MAX_MESSAGE_SIZE", 16384))
+CAPACITY_REPORT_INTERVAL = float(os.environ.get("CAPACITY_REPORT_INTERVAL", 5))
+# Metrics are off unless one of these is set (see metrics.py). METRICS_PORT
+# serves /metrics, /metrics.json and /sessions over HTTP (worker i uses
+# METRICS_PORT + i); METRICS_DUMP_INTERVAL logs a summary every N seconds.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+METRICS_DUMP_INTERVAL = float(os.environ.get("METRICS_DUMP_INTERVAL", 0))
+
+maps.register_builtin_maps(BOARD_WIDTH, BOARD_HEIGHT)
+if MAPS_DIR:
+    maps.load_maps(MAPS_DIR)
+
+logger = log.get_logger("game")
+
+# Hot-path instruments; each observation is a no-op while metrics are disabled
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+MESSAGE_TYPES = ("join", "move", "ack", "resync") # other inbound types are counted as "unknown"
+tick_seconds = metrics.Histogram("game_tick_seconds", "Time to run one session tick, broadcast included", TIME_BUCKETS)
+tick_lateness = metrics.Histogram("game_tick_lateness_seconds", "How late a tick started against its schedule",
+                                  TIME_BUCKETS)
+tick_overruns = metrics.Counter("game_tick_overruns_total", "Ticks that finished after the next tick was due")
+ticks_skipped = metrics.Counter("game_ticks_skipped_total", "Ticks skipped because a session fell behind")
+broadcast_seconds = metrics.Histogram("game_broadcast_seconds", "Time to build, encode and queue one broadcast",
+                                      TIME_BUCKETS, label="type")
+broadcast_bytes = metrics.Histogram("game_broadcast_bytes", "Bytes queued by one broadcast across its recipients",
+                                    SIZE_BUCKETS, label="type")
+encode_seconds = metrics.Histogram("game_encode_seconds", "Time to serialize one outbound message", TIME_BUCKETS,
+                                   label="codec")
+connections_rejected = metrics.Counter("game_connections_rejected_total", "Connections turned away at the handshake",
+                                       label="reason")
+messages_received = metrics.Counter("game_messages_received_total", "Inbound messages by type", label="type")
+bytes_sent = metrics.Counter("game_bytes_queued_total", "Outbound bytes queued for sending", label="type")
+
+# Set in each worker process by main()
+worker_index = 0
+worker_count = 1
+draining = False # Set by drain(); no new sessions are created
 
 # Global state for game.py
 # players: websocket -> player_id (username)
@@ -16,7 +163,42 @@ GAME_SERVER_PORT = int(os.environ.get("GAME_PORT", 9001))
 # --- STATE MANAGEMENT (More robust) ---
 # These will store state PER GAME INSTANCE (i.e., per room_id derived from path)
 # For a single game.py process handling multiple rooms via path:
-game_sessions = {} #  match_id: { "players": {player_id: websocket}, "state": {...game specific state...} }
+input_totals = {"accepted": 0, "coalesced": 0, "rate_limited": 0} # Process-wide input counters
+game_sessions = {} # match_id: GameSession (see session.py)
+timers = TimerQueue() # match ends, idle kicks, reconnect grace windows, empty-session reaping
+phase_load = [0] * max(1, TICK_PHASES) # sessions per tick phase
+batch_engine = None # engine.BatchEngine, set by main() when BATCH_ENGINE is on
+phase_sessions = [{} for _ in phase_load] # BATCH_ENGINE: match_id: session, per tick phase
+phase_tasks = {} # BATCH_ENGINE: phase: its running phase_tick_loop
+replay_log = ReplayLog(REPLAY_DIR) if REPLAY_DIR else None
+control_links = set() # authenticated master control connections
+unreported_results = deque(maxlen=1000) # match_result messages not yet sent to a master
+flushing_results = False
+open_connections = 0 # admitted player connections, see GameServerProtocol
+pending_handshakes = 0
+
+def send_queue_depths():
+    depths = [outbox.depth for session in game_sessions.values() for outbox in session.outboxes.values()]
+    return {"total": sum(depths), "max": max(depths, default=0)}
+
+metrics.Gauge("game_sessions_active", "Sessions in this process", callback=lambda: len(game_sessions))
+metrics.Gauge("game_sessions_idle", "Sessions ticking at the idle rate",
+              callback=lambda: sum(session.idle for session in game_sessions.values()))
+metrics.Gauge("game_connections_active", "Joined player connections",
+              callback=lambda: sum(len(session.players) for session in game_sessions.values()))
+metrics.Gauge("game_connections_open", "Player connections admitted at the handshake and still open",
+              callback=lambda: open_connections)
+metrics.Gauge("game_handshakes_pending", "Opening handshakes in progress", callback=lambda: pending_handshakes)
+metrics.Gauge("game_send_queue_frames", "Frames waiting in per-connection send queues", label="stat",
+              callback=send_queue_depths)
+metrics.Gauge("game_inputs_total", "Rate-limited inputs by outcome", label="outcome", callback=lambda: input_totals)
+metrics.Gauge("game_timers_pending", "Scheduled session timers", callback=lambda: len(timers))
+metrics.Gauge("game_log_dropped_records_total", "Log records dropped because the log queue was full",
+              callback=lambda: log.dropped_records)
+
+def shard_for_match(match_id, workers):
+    # Must stay in sync with shard_for_match() in master_server/master.py
+    return zlib.crc32(str(match_id).encode("utf-8")) % workers
 
 def get_match_id_from_path(path: str):
     # Path will be like "/game/MATCH_ID"
@@ -25,77 +207,188 @@ def get_match_id_from_path(path: str):
         return parts[1]
     return None
 
+def overloaded(reason):
+    connections_rejected.inc(label_value=reason)
+    logger.debug("connection_rejected", reason=reason)
+    return http.HTTPStatus.SERVICE_UNAVAILABLE, [("Retry-After", "5")], b"Server full\n"
+
+class GameServerProtocol(WebSocketServerProtocol):
+    # Admission control at the opening handshake. Every check is a counter or
+    # dict lookup, so rejecting stays cheap however overloaded the server is.
+    # The master's control connection is exempt from the connection cap.
+    admitted = False # counted in open_connections until the connection is lost
+
+    async def handshake(self, *args, **kwargs):
+        global pending_handshakes
+        if MAX_HANDSHAKES and pending_handshakes >= MAX_HANDSHAKES:
+            raise AbortHandshake(*overloaded("handshakes"))
+        pending_handshakes += 1
+        try:
+            return await super().handshake(*args, **kwargs)
+        finally:
+            pending_handshakes -= 1
+
+    async def process_request(self, path, request_headers):
+        global open_connections
+        if path == CONTROL_PATH:
+            return None
+        if MAX_CONNECTIONS and open_connections >= MAX_CONNECTIONS:
+            return overloaded("connections")
+        if get_match_id_from_path(path) not in game_sessions:
+            if CONTROL_TOKEN: # Only matches the master registered
+                connections_rejected.inc(label_value="unknown_match")
+                return http.HTTPStatus.NOT_FOUND, [], b"Unknown match\n"
+            if sessions_full():
+                return overloaded("sessions")
+        self.admitted = True
+        open_connections += 1
+        return None
+
+    def connection_lost(self, exc):
+        global open_connections
+        if self.admitted:
+            self.admitted = False
+            open_connections -= 1
+        super().connection_lost(exc)
+
+def headroom():
+    # Spare capacity for the master; None where there is no limit
+    return {"sessions": MAX_SESSIONS - len(game_sessions) if MAX_SESSIONS else None,
+            "connections": MAX_CONNECTIONS - open_connections if MAX_CONNECTIONS else None,
+            "draining": draining}
+
 async def handle_player(websocket: WebSocketServerProtocol, path: str):
+    if path == CONTROL_PATH:
+        await handle_control(websocket)
+        return
     match_id = get_match_id_from_path(path)
     if not match_id:
-        print(f"[{timestamp()}] Invalid path: {path}. Closing connection.")
+        logger.warning("invalid_path", path=path)
         await websocket.close(code=1003, reason="Invalid path") # 1003: cannot accept data
         return
+    if worker_count > 1 and shard_for_match(match_id, worker_count) != worker_index:
+        logger.warning("match_not_owned", match_id=match_id, worker=worker_index)
+        await websocket.close(code=1008, reason="Match hosted by another worker") # 1008: policy violation
+        return
 
     player_id = None # Will be the username
 
     try:
-        # Initialize game session if it's the first player for this match_id
-        if match_id not in game_sessions:
-            game_sessions[match_id] = {
-                "players": {}, # player_id (username): websocket
-                "state": initialize_game_state() # Implement this function
-            }
-            print(f"[{timestamp()}] Initialized game session for match_id: {match_id}")
-
-        session = game_sessions[match_id]
+        session = get_session(match_id)
+        if session is None:
+            await close_unavailable(websocket)
+            return
 
         async for message_str in websocket:
             try:
-                data = json.loads(message_str)
-            except json.JSONDecodeError:
-                print(f"[{timestamp()}] Invalid JSON from {player_id or websocket.remote_address} in {match_id}: {message_str}")
-                await websocket.send(json.dumps({"type": "error", "message": "Invalid JSON format"}))
+                data = wire.decode(message_str) # JSON text or bin1 binary frame
+            except ValueError:
+                logger.warning("invalid_message", match_id=match_id, player_id=player_id or websocket.remote_address,
+                               size=len(message_str))
+                await websocket.send(json.dumps({"type": "error", "message": "Invalid message format"}))
+                continue
+            if not isinstance(data, dict):
+                await websocket.send(json.dumps({"type": "error", "message": "Invalid message format"}))
                 continue
 
             action_type = data.get("type") # Client sends "type"
+            messages_received.inc(label_value=action_type if action_type in MESSAGE_TYPES else "unknown")
 
             if action_type == "join":
-                # Client sends: {"type": "join", "username": "user123"}
+                # Client sends: {"type": "join", "username": "user123", "codecs": ["bin1", "json"]}
+                # ("codecs" is optional; without it the connection stays on JSON).
+                # A client coming back within the grace window adds the
+                # "resume" token from its last join_ack and the last state
+                # "version" it applied, and gets only the changes since then.
                 username = data.get("username")
-                if not username:
+                if not username or not isinstance(username, str):
                     await websocket.send(json.dumps({"type": "error", "message": "Username missing in join message."}))
                     continue
                 
-                if player_id and player_id != username: # Should not happen if client is well-behaved
-                     await websocket.send(json.dumps({"type": "error", "message": "Username mismatch."}))
-                     continue
+                if player_id:
+                    # One join per connection. A repeat would broadcast player_joined,
+                    # send a keyframe and open a new outbox every time, past the
+                    # input rate limit; reconnects and resumes use a new connection
+                    logger.debug("duplicate_join", match_id=match_id, player_id=player_id)
+                    await websocket.send(json.dumps({"type": "error", "message": "Already joined."}))
+                    continue
+                if session.expected is not None and username not in session.expected:
+                    logger.warning("player_not_registered", match_id=match_id, player_id=username)
+                    await websocket.send(json.dumps({"type": "error", "message": "Not a player in this match."}))
+                    await websocket.close(code=1008, reason="Not a player in this match")
+                    return
                 
                 player_id = username # Set player_id for this connection
+                # The session may have been reaped while this connection sat unjoined
+                session = get_session(match_id)
+                if session is None:
+                    await close_unavailable(websocket)
+                    return
 
                 # Check if player already in session (e.g. reconnect with same username but different websocket)
-                if player_id in session["players"] and session["players"][player_id] != websocket:
-                    print(f"[{timestamp()}] Player {player_id} rejoining/already joined in {match_id}. Closing old connection if any.")
-                    old_ws = session["players"].get(player_id)
+                if player_id in session.players and session.players[player_id] != websocket:
+                    logger.info("player_replaced", match_id=match_id, player_id=player_id)
+                    old_ws = session.players.get(player_id)
                     if old_ws and old_ws != websocket:
                         await old_ws.close(reason="New connection for player") #
                 
-                session["players"][player_id] = websocket
+                session.players[player_id] = websocket
+                timers.cancel(session.timers.pop(("grace", player_id), None)) # Back within the grace window
+                timers.cancel(session.timers.pop("reap", None))
+                session.last_seen[player_id] = session.last_input = timers.time()
+                wake_session(session)
+                if IDLE_TIMEOUT > 0 and ("idle", player_id) not in session.timers:
+                    session.timers["idle", player_id] = timers.call_later(IDLE_TIMEOUT, check_idle, match_id,
+                                                                          session, player_id)
+                old_outbox = session.outboxes.get(player_id)
+                if old_outbox:
+                    old_outbox.close()
+                session.outboxes[player_id] = Outbox(websocket, f"{player_id}@{match_id}", MAX_SEND_QUEUE,
+                                                        SLOW_CONSUMER_TIMEOUT, on_slow=log_slow_consumer)
+                resumed = can_resume(session, player_id, data.get("resume"), data.get("version"))
+                if resumed:
+                    session.acked[player_id] = data["version"] # Catch-up delta from there
+                    session.views.setdefault(player_id, {})
+                else:
+                    session.acked[player_id] = None # Full keyframe on (re)join
+                    session.views[player_id] = {}
+                session.resume_tokens[player_id] = resume_token = secrets.token_urlsafe(16)
+                session.buckets.setdefault(player_id, TokenBucket(INPUT_RATE, INPUT_BURST))
+                session.input_stats.setdefault(player_id, {"accepted": 0, "coalesced": 0, "rate_limited": 0})
+                codec = wire.negotiate(data.get("codecs"))
+                session.codecs[player_id] = codec
                 # Add player to game state if not already there
-                if player_id not in session["state"]["players"]:
-                     session["state"]["players"][player_id] = {"score": 0, "position": (0,0)} # Example
+                if session.replay is not None and player_id not in session.state.players:
+                    session.replay.join(session.tick, player_id)
+                session.state.add_player(player_id, rules.spawn_position(session.state))
 
-                print(f"[{timestamp()}] Player {player_id} joined match {match_id}")
+                logger.info("player_joined", match_id=match_id, player_id=player_id, codec=codec, resumed=resumed)
 
-                # Notify others in the room (optional, or rely on next game_state broadcast)
-                await broadcast_to_session(match_id, {
-                    "type": "player_event", # Generic event type
-                    "event": "player_joined",
-                    "player_id": player_id
-                }, exclude_player_id=player_id)
+                # Notify others in the room (optional, or rely on next game_state broadcast).
+                # A resumed player never left as far as they are concerned.
+                if not resumed:
+                    await broadcast_to_session(match_id, {
+                        "type": "player_event", # Generic event type
+                        "event": "player_joined",
+                        "player_id": player_id
+                    }, exclude_player_id=player_id)
 
-                # Send initial game state or ack
-                await websocket.send(json.dumps({"type": "join_ack", "status": "success", "player_id": player_id, "match_id": match_id}))
-                await websocket.send(json.dumps({"type": "game_state", "state": session["state"]}))
+                # Send ack, then the keyframe (or catch-up delta) to this player and the new
+                # player's record to everyone else. "seq" is the last move processed for this
+                # player, so a client that rejoins keeps numbering its moves from there;
+                # "resume" is the token for the next reconnect.
+                await websocket.send(json.dumps({"type": "join_ack", "status": "success", "player_id": player_id,
+                                                 "match_id": match_id, "codec": codec, "tick_rate": TICK_RATE,
+                                                 "seq": session.state.players[player_id].seq,
+                                                 "resume": resume_token, "resumed": resumed}))
+                await broadcast_state(match_id, session)
 
 
             elif action_type == "move":
-                # Client sends: {"type": "move", "direction": "up"}
+                # Client sends: {"type": "move", "direction": "up", "seq": 17}
+                # "seq" is optional and increases with every move; once the move
+                # is processed the player's "seq" in game_state reports it, so the
+                # client can predict its own movement and reconcile.
                 if not player_id: # Player must have joined first
                     await websocket.send(json.dumps({"type": "error", "message": "Must join before moving."}))
                     continue
@@ -104,42 +397,66 @@ async def handle_player(websocket: WebSocketServerProtocol, path: str):
                 if not direction:
                     await websocket.send(json.dumps({"type": "error", "message": "Direction missing in move."}))
                     continue
+                # Checked here, not at the tick: anything else would fail inside
+                # the tick loop and stop the match for everyone
+                if not isinstance(direction, str) or direction not in rules.MOVES:
+                    await websocket.send(json.dumps({"type": "error", "message": "Invalid direction in move."}))
+                    continue
+                seq = data.get("seq")
+                if seq is not None:
+                    # Must be above both the last processed seq and the one
+                    # already pending this tick, or the reported seq could go
+                    # backwards (bool passes isinstance(seq, int))
+                    player = session.state.players.get(player_id)
+                    last = player.seq if player is not None else 0
+                    pending = session.pending_moves.get(player_id)
+                    if pending is not None and pending[1] is not None:
+                        last = max(last, pending[1])
+                    if not isinstance(seq, int) or isinstance(seq, bool) or seq <= last:
+                        logger.debug("move_seq_rejected", match_id=match_id, player_id=player_id, seq=seq)
+                        continue
 
-                print(f"[{timestamp()}] Player {player_id} in match {match_id} moved: {direction}")
-                
-                # --- ACTUAL GAME LOGIC HERE ---
-                # update_game_state_on_move(session["state"], player_id, direction)
-                # This function would modify session["state"] (e.g. player position, score)
-                # For example:
-                # new_pos = calculate_new_pos(session["state"]["players"][player_id]["position"], direction)
-                # session["state"]["players"][player_id]["position"] = new_pos
-                # if new_pos == gem_location: session["state"]["players"][player_id]["score"] +=1 etc.
-                # session["state"]["time_remaining"] -= 0.1 # if moves tick time
-                
-                # For now, just echo back, but you need real logic
-                # For simplicity, let's assume some game state update
-                session["state"]["last_move_by"] = player_id 
-                session["state"]["last_direction"] = direction
+                if not allow_input(session, player_id):
+                    logger.debug("input_rate_limited", match_id=match_id, player_id=player_id)
+                    continue
+                logger.debug("player_move", match_id=match_id, player_id=player_id, direction=direction)
+                session.last_seen[player_id] = session.last_input = timers.time()
+                wake_session(session)
+
+                # Queue the input; session_tick_loop applies it and broadcasts on the next tick.
+                # Several moves within one tick coalesce into the last one.
+                if player_id in session.pending_moves:
+                    count_input(session, player_id, "coalesced")
+                session.pending_moves[player_id] = (direction, seq)
+
+            elif action_type == "ack":
+                # Client sends: {"type": "ack", "version": 42} after applying a game_state
+                version = data.get("version")
+                if player_id and isinstance(version, int) and 0 <= version <= session.tracker.version:
+                    session.acked[player_id] = version
 
-                # Broadcast new game state to all in the same session
-                await broadcast_to_session(match_id, {"type": "game_state", "state": session["state"]})
+            elif action_type == "resync":
+                # Client lost track of the state; the next broadcast sends it a keyframe.
+                # Rate limited like moves, since every resync costs a full keyframe.
+                if player_id and allow_input(session, player_id):
+                    session.acked[player_id] = None
 
             # No explicit "leave" from client, handled by disconnect.
             # If client *did* send a "leave", you'd call handle_disconnect here.
 
             else:
-                print(f"[{timestamp()}] Unknown action type from {player_id} in {match_id}: {action_type}")
+                logger.warning("unknown_action", match_id=match_id, player_id=player_id, action=action_type)
                 await websocket.send(json.dumps({"type": "error", "message": f"Unknown action type: {action_type}"}))
 
 
     except websockets.exceptions.ConnectionClosedOK:
-        print(f"[{timestamp()}] Player {player_id or websocket.remote_address} disconnected gracefully from {match_id}.")
+        logger.info("connection_closed", match_id=match_id, player_id=player_id or websocket.remote_address)
     except websockets.exceptions.ConnectionClosedError as e:
-        print(f"[{timestamp()}] Player {player_id or websocket.remote_address} connection closed with error from {match_id}: {e}")
+        logger.info("connection_closed_error", match_id=match_id, player_id=player_id or websocket.remote_address,
+                    error=e)
     except Exception as e:
-        print(f"[{timestamp()}] Error in handler for {player_id or websocket.remote_address} in {match_id}: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error("handler_error", exc_info=True, match_id=match_id,
+                     player_id=player_id or websocket.remote_address, error=e)
     finally:
         if player_id and match_id and match_id in game_sessions:
             await handle_disconnect(player_id, match_id, websocket)
@@ -150,26 +467,48 @@ async def handle_disconnect(player_id, match_id, websocket_that_disconnected):
         return
 
     # Only remove if the disconnected websocket is the one registered for this player_id
-    if session["players"].get(player_id) == websocket_that_disconnected:
-        print(f"[{timestamp()}] Player {player_id} disconnected from match {match_id}")
-        session["players"].pop(player_id, None)
-        
-        # Also remove player from game state representation if necessary
-        if "players" in session["state"] and player_id in session["state"]["players"]:
-            session["state"]["players"].pop(player_id, None) # Example, adjust based on your state structure
-
-        if not session["players"]:
-            print(f"[{timestamp()}] Match {match_id} is empty. Cleaning up session.")
-            del game_sessions[match_id]
+    if session.players.get(player_id) == websocket_that_disconnected:
+        session.players.pop(player_id, None)
+        session.acked.pop(player_id, None)
+        session.codecs.pop(player_id, None)
+        session.pending_moves.pop(player_id, None)
+        outbox = session.outboxes.pop(player_id, None)
+        if outbox:
+            outbox.close()
+        timers.cancel(session.timers.pop(("idle", player_id), None))
+
+        if RECONNECT_GRACE > 0 and not session.state.game_over:
+            # Keep the player's place; rejoining within the window resumes it
+            logger.info("player_disconnected", match_id=match_id, player_id=player_id, grace=RECONNECT_GRACE)
+            session.timers["grace", player_id] = timers.call_later(RECONNECT_GRACE, expire_player, match_id,
+                                                                   session, player_id)
         else:
-            # Notify remaining players
-            await broadcast_to_session(match_id, {
-                "type": "player_event",
-                "event": "player_left",
-                "player_id": player_id
-            })
-            # Optionally send updated game state if player leaving affects it
-            await broadcast_to_session(match_id, {"type": "game_state", "state": session["state"]})
+            await remove_player(match_id, session, player_id)
+        if not session.players:
+            schedule_reap(match_id, session)
+
+async def remove_player(match_id, session, player_id):
+    logger.info("player_left", match_id=match_id, player_id=player_id)
+    session.buckets.pop(player_id, None)
+    session.last_seen.pop(player_id, None)
+    session.views.pop(player_id, None)
+    session.resume_tokens.pop(player_id, None)
+    stats = session.input_stats.pop(player_id, None)
+    if stats and stats["rate_limited"]:
+        logger.info("player_inputs_rate_limited", match_id=match_id, player_id=player_id, **stats)
+    if session.replay is not None and player_id in session.state.players:
+        session.replay.leave(session.tick, player_id)
+    session.state.remove_player(player_id)
+
+    if session.players:
+        # Notify remaining players
+        await broadcast_to_session(match_id, {
+            "type": "player_event",
+            "event": "player_left",
+            "player_id": player_id
+        })
+        # Send the removal as a delta
+        await broadcast_state(match_id, session)
 
 
 async def broadcast_to_session(match_id, message_data, exclude_player_id=None):
@@ -177,83 +516,749 @@ async def broadcast_to_session(match_id, message_data, exclude_player_id=None):
     if not session:
         return
 
-    try:
-        message_json = json.dumps(message_data)
-    except TypeError as e:
-        print(f"[{timestamp()}] Error serializing message for broadcast in {match_id}: {e}")
+    started = time.perf_counter()
+    recipients = [pid for pid in session.players if pid != exclude_player_id]
+    sent = send_to_players(match_id, session, message_data, recipients)
+    broadcast_seconds.observe(time.perf_counter() - started, message_data.get("type"))
+    broadcast_bytes.observe(sent, message_data.get("type"))
+
+
+async def broadcast_state(match_id, session, keyframe=False):
+    # Commits pending state changes as a new version and sends every player the
+    # changes since the version it last acked. Players are grouped by acked
+    # version so each distinct frame is serialized once. Players without an
+    # acked version (just joined, resync, too far behind) get a full keyframe.
+    # send_to_players then encodes each frame once per codec in use.
+    # With AOI_RADIUS set every player gets a frame of their own instead.
+    started = time.perf_counter()
+    sent = 0
+    tracker = session.tracker
+    version = tracker.commit()
+    if keyframe:
+        session.last_keyframe_tick = session.tick
+
+    if AOI_RADIUS > 0:
+        deltas = {} # base version: changes since then, shared by the players at that base
+        for pid in session.players:
+            view = session.views.setdefault(pid, {})
+            base = None if keyframe else session.acked.get(pid)
+            message_data = interest.state_message(session, view, pid, base, AOI_RADIUS, deltas)
+            if message_data is not None:
+                sent += send_to_players(match_id, session, message_data, (pid,))
+        broadcast_seconds.observe(time.perf_counter() - started, "game_state")
+        broadcast_bytes.observe(sent, "game_state")
         return
 
-    disconnected_players_during_broadcast = [] # Store (pid, ws) tuples
+    groups = {} # base version: [player_id]
+    for pid in session.players:
+        base = None if keyframe else session.acked.get(pid)
+        groups.setdefault(base, []).append(pid)
+
+    for base, pids in groups.items():
+        paths = tracker.delta_since(base)
+        if paths is None:
+            # Encoded at most once per version and codec, however many players need it
+            sent += send_to_players(match_id, session, session.keyframe_message(), pids, session.keyframe_frames())
+        elif paths: # Empty means already up to date
+            changes, removed = build_delta(session.state, paths)
+            message_data = {"type": "game_state", "version": version, "base": base,
+                            "changes": changes, "removed": removed}
+            sent += send_to_players(match_id, session, message_data, pids)
+    broadcast_seconds.observe(time.perf_counter() - started, "game_state")
+    broadcast_bytes.observe(sent, "game_state")
 
-    for pid, ws in list(session["players"].items()): # Iterate over a copy of items for safe modification
-        if pid == exclude_player_id:
+
+def send_to_players(match_id, session, message_data, player_ids, frames=None):
+    # Only queues frames; each player's Outbox writer does the actual send, so
+    # a slow client never holds up the others. Returns the bytes queued.
+    # `frames` can carry encodings to reuse across calls (e.g. keyframes).
+    if frames is None:
+        frames = {} # codec: encoded frame, so each codec is serialized once
+    message_type = message_data.get("type")
+    is_state = message_type == "game_state"
+    sent = 0
+
+    for pid in player_ids:
+        outbox = session.outboxes.get(pid)
+        if outbox is None: # Left while the broadcast was being built
             continue
+        codec = session.codecs.get(pid, wire.JSON)
+        frame = frames.get(codec)
+        if frame is None:
+            started = time.perf_counter()
+            try:
+                frame = frames[codec] = wire.encode(message_data, codec)
+            except (TypeError, ValueError) as e:
+                logger.error("serialize_error", match_id=match_id, type=message_type, codec=codec, error=e)
+                return sent
+            encode_seconds.observe(time.perf_counter() - started, codec)
+        if outbox.send(frame, state=is_state):
+            sent += len(frame)
+            session.frames_sent += 1
+    session.bytes_sent += sent
+    bytes_sent.inc(sent, message_type)
+    return sent
+
+def log_slow_consumer(outbox):
+    # The handler's receive loop ends when the socket closes and runs handle_disconnect
+    logger.warning("slow_consumer", connection=outbox.name, queued=outbox.depth)
+
+
+def initialize_game_state(map_name=None):
+    # The board shares its map template's cells; only changed cells are stored per session
+    board = Board(maps.get_map(map_name or DEFAULT_MAP))
+    return new_state(board, DELTA_HISTORY, time_remaining=MATCH_DURATION)
+
+def get_session(match_id):
+    # Initialize game session if it's the first connection for this match_id.
+    # None while draining, at MAX_SESSIONS, and with CONTROL_TOKEN for matches
+    # the master has not registered.
+    session = game_sessions.get(match_id)
+    if session is None and not draining and not CONTROL_TOKEN and not sessions_full():
+        session = start_session(match_id, initialize_game_state(), MATCH_DURATION)
+        logger.info("session_created", match_id=match_id, tick_rate=TICK_RATE)
+    return session
+
+def sessions_full():
+    return MAX_SESSIONS > 0 and len(game_sessions) >= MAX_SESSIONS
+
+async def close_unavailable(websocket):
+    # get_session() had no session for this connection
+    if draining:
+        await websocket.close(code=1013, reason="Server draining") # 1013: try again later
+    elif CONTROL_TOKEN:
+        await websocket.close(code=1008, reason="Unknown match")
+    else:
+        await websocket.close(code=1013, reason="Server full")
+
+def start_session(match_id, state, duration, restored_from=None):
+    session = game_sessions[match_id] = GameSession(match_id, state)
+    session.phase = assign_phase()
+    session.started_at = timers.time()
+    session.ends_at = session.started_at + duration
+    if replay_log is not None:
+        session.replay = replay_log.open(match_id, {
+            "match_id": match_id, "map": state.grid.template.name, "duration": float(duration),
+            "tick_rate": TICK_RATE, "snapshot": restored_from})
+        session.replay.version = state.tracker.version
+    if not state.game_over:
+        session.timers["end"] = timers.call_at(session.ends_at, end_match, match_id, session)
+    if batch_engine is not None:
+        batch_engine.attach(state)
+        phase_sessions[session.phase][match_id] = session
+        if session.phase not in phase_tasks:
+            phase_tasks[session.phase] = asyncio.create_task(phase_tick_loop(session.phase))
+    else:
+        session.tick_task = asyncio.create_task(session_tick_loop(match_id, session))
+    schedule_reap(match_id, session) # In case nobody ever joins
+    return session
+
+def close_session(match_id, session, reason):
+    logger.info("session_closed", match_id=match_id, reason=reason)
+    if game_sessions.get(match_id) is session:
+        del game_sessions[match_id]
+        phase_load[session.phase] -= 1
+    stop_session_ticks(session)
+    if batch_engine is not None:
+        batch_engine.detach(session.state)
+    for timer in session.timers.values():
+        timers.cancel(timer)
+    session.timers.clear()
+    if session.replay is not None:
+        session.replay.close()
+
+
+# Timer callbacks (see timers.py). They run on the event loop between other
+# callbacks; anything that must broadcast hands off to a task.
+
+def end_match(match_id, session):
+    session.timers.pop("end", None)
+    state = session.state
+    state.set("time_remaining", 0)
+    state.set("game_over", True)
+    state.set("winner", rules.pick_winner(state))
+    logger.info("game_over", match_id=match_id, winner=state.winner)
+    if CONTROL_TOKEN:
+        unreported_results.append({"type": "match_result", "match_id": match_id, "winner": state.winner,
+                                   "scores": {pid: player.score for pid, player in state.players.items()}})
+        asyncio.ensure_future(flush_results())
+    if session.replay is not None:
+        session.replay.end(session.tick, timers.time() - session.started_at)
+    # The tick loop broadcasts the final state on its next tick and stops
+    wake_session(session)
+
+def expire_player(match_id, session, player_id):
+    # Grace window ran out without a reconnect
+    session.timers.pop(("grace", player_id), None)
+    if player_id not in session.players and game_sessions.get(match_id) is session:
+        asyncio.ensure_future(remove_player(match_id, session, player_id))
+
+def check_idle(match_id, session, player_id):
+    session.timers.pop(("idle", player_id), None)
+    websocket = session.players.get(player_id)
+    if websocket is None or game_sessions.get(match_id) is not session:
+        return
+    idle_for = timers.time() - session.last_seen.get(player_id, 0)
+    if idle_for < IDLE_TIMEOUT:
+        # Active since the timer was set; check again when it could next expire
+        session.timers["idle", player_id] = timers.call_later(IDLE_TIMEOUT - idle_for, check_idle, match_id,
+                                                              session, player_id)
+        return
+    logger.info("player_idle", match_id=match_id, player_id=player_id, idle_for=round(idle_for, 1))
+    # The handler's receive loop ends and runs handle_disconnect
+    asyncio.ensure_future(websocket.close(code=1000, reason="Idle timeout"))
+
+def schedule_reap(match_id, session, delay=None):
+    # Close the session if nobody is connected by then. Never sooner than the
+    # grace window, so a disconnected player can still come back.
+    if "reap" not in session.timers:
+        delay = max(EMPTY_SESSION_TIMEOUT, RECONNECT_GRACE, delay or 0)
+        session.timers["reap"] = timers.call_later(delay, reap_session, match_id, session)
+
+def reap_session(match_id, session):
+    session.timers.pop("reap", None)
+    if not session.players and game_sessions.get(match_id) is session:
+        close_session(match_id, session, "empty")
+
+def can_resume(session, player_id, token, version):
+    # A rejoin may pick up from the client's last state version if it carries
+    # the token from the player's last join_ack and the player still holds a
+    # place in the match (connected elsewhere or within the grace window)
+    expected = session.resume_tokens.get(player_id)
+    return (expected is not None and isinstance(token, str) and hmac.compare_digest(token, expected)
+            and player_id in session.state.players
+            and isinstance(version, int) and 0 <= version <= session.tracker.version)
+
+def allow_input(session, player_id):
+    # Spends a token from the player's bucket; False means drop the message
+    bucket = session.buckets.get(player_id)
+    if bucket is None or bucket.allow():
+        count_input(session, player_id, "accepted")
+        return True
+    count_input(session, player_id, "rate_limited")
+    return False
+
+def count_input(session, player_id, outcome):
+    input_totals[outcome] += 1
+    stats = session.input_stats.get(player_id)
+    if stats is not None:
+        stats[outcome] += 1
+
+def apply_input(session, player_id, direction):
+    # Movement, collisions, gems and scoring live in rules.py
+    return rules.move(session.state, player_id, direction)
+
+def tick_session(match_id, session, now, moves_applied=False):
+    """Advance one session by one tick. Returns True if the state changed.
+
+    moves_applied: the pending moves were already applied by batch_engine.step().
+    """
+    state = session.state
+    session.tick += 1
+    changed = False
+
+    moves = session.pending_moves
+    session.pending_moves = {}
+    if moves and session.replay is not None:
+        session.replay.inputs(session.tick, moves)
+    for player_id, (direction, seq) in moves.items():
+        if not state.game_over and not moves_applied:
+            changed = apply_input(session, player_id, direction) or changed
+        if seq is not None:
+            state.set_seq(player_id, seq) # Processed, even if it was a no-op
+
+    if not state.game_over:
+        # Only the countdown; the match-end timer sets game_over (and 0)
+        if state.set("time_remaining", max(1, math.ceil(session.ends_at - now))):
+            changed = True
+
+    # Changes made between ticks (e.g. by timers) go out with this tick
+    return changed or bool(session.tracker.pending)
+
+def assign_phase():
+    # Least used phase slot; released in close_session()
+    slot = min(range(len(phase_load)), key=phase_load.__getitem__)
+    phase_load[slot] += 1
+    return slot
+
+def wake_session(session):
+    # Back to full tick rate right away if the session was idling
+    if session.idle:
+        session.wake.set()
+
+async def session_tick_loop(match_id, session):
+    # Fixed-rate authoritative loop for one session. Replaces the old global
+    # game_loop(): inputs are drained once per tick and at most one game_state
+    # broadcast goes out per tick, however fast players send moves.
+    # Ticks fall on multiples of the interval shifted by the session's phase,
+    # so sessions in different phases never tick together. Idle sessions tick
+    # on every idle_every-th slot of the same grid and wake early on input.
+    full_interval = 1 / TICK_RATE
+    idle_every = max(1, round(TICK_RATE / IDLE_TICK_RATE)) if IDLE_TICK_RATE > 0 else 1
+    offset = session.phase * full_interval / len(phase_load)
+    loop = asyncio.get_running_loop()
+
+    def next_slot(now, interval):
+        return (math.floor((now - offset) / interval) + 1) * interval + offset
+
+    interval = full_interval
+    next_tick = next_slot(loop.time(), interval)
+    stats = session.tick_stats
+    try:
+        while game_sessions.get(match_id) is session:
+            delay = next_tick - loop.time()
+            if delay > 0:
+                if session.idle:
+                    session.wake.clear()
+                    try:
+                        await asyncio.wait_for(session.wake.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(delay)
+            now = loop.time()
+            if session.idle and session.wake.is_set():
+                # Input arrived; resume on the next full-rate slot
+                session.idle = False
+                interval = full_interval
+                next_tick = next_slot(now, interval)
+                continue
+            late = now - next_tick
+            if late >= interval:
+                # Fell behind (e.g. a long GC pause); skip missed ticks instead
+                # of bursting, staying on this session's phase
+                missed = int(late // interval)
+                stats["skipped"] += missed
+                ticks_skipped.inc(missed)
+                next_tick += missed * interval
+                late -= missed * interval
+            stats["late_total"] += late
+            stats["late_max"] = max(stats["late_max"], late)
+            tick_lateness.observe(late)
+            next_tick += interval
+
+            if game_sessions.get(match_id) is not session:
+                break
+            started = time.perf_counter()
+            changed = tick_session(match_id, session, now)
+            await finish_tick(match_id, session, now, changed)
+            duration = time.perf_counter() - started
+            tick_seconds.observe(duration)
+            if late + duration > interval:
+                stats["overruns"] += 1
+                tick_overruns.inc()
+            if not session.idle and idle_every > 1 and now - session.last_input >= IDLE_TICK_AFTER:
+                session.idle = True
+                interval = full_interval * idle_every
+                next_tick = next_slot(now, interval)
+            if session.state.game_over:
+                break # Nothing changes after game over; the session is reaped when empty
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        logger.error("tick_error", exc_info=True, match_id=match_id, error=e)
+
+async def phase_tick_loop(phase):
+    # BATCH_ENGINE counterpart of session_tick_loop(): ticks every session on
+    # one phase. The pending moves of all sessions due this slot are applied
+    # by one batch_engine.step(), then each session finishes its tick as
+    # usual. Idle sessions tick on every idle_every-th slot, or on the next
+    # slot once an input wakes them. Ends when the phase has no sessions left.
+    full_interval = 1 / TICK_RATE
+    idle_every = max(1, round(TICK_RATE / IDLE_TICK_RATE)) if IDLE_TICK_RATE > 0 else 1
+    offset = phase * full_interval / len(phase_load)
+    loop = asyncio.get_running_loop()
+    sessions = phase_sessions[phase]
+    next_tick = (math.floor((loop.time() - offset) / full_interval) + 1) * full_interval + offset
+    slot = 0
+    try:
+        while sessions:
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = loop.time()
+            late = now - next_tick
+            missed = 0
+            if late >= full_interval:
+                # Fell behind; skip missed slots instead of bursting
+                missed = int(late // full_interval)
+                ticks_skipped.inc(missed)
+                next_tick += missed * full_interval
+                late -= missed * full_interval
+            next_tick += full_interval
+            slot += missed + 1
+            tick_lateness.observe(late)
+
+            due = []
+            for match_id, session in sessions.items():
+                if session.idle:
+                    if session.wake.is_set():
+                        session.idle = False
+                    elif slot % idle_every:
+                        continue
+                stats = session.tick_stats
+                stats["skipped"] += missed
+                stats["late_total"] += late
+                stats["late_max"] = max(stats["late_max"], late)
+                due.append((match_id, session))
+
+            # One session's failure must not stop the loop: it would freeze
+            # every match on this phase. A failed step drops this tick's
+            # moves; a session whose own tick fails stops ticking, as it
+            # would with session_tick_loop()
+            started = time.perf_counter()
+            try:
+                batch_engine.step([session for _, session in due])
+            except Exception as e:
+                logger.error("tick_error", exc_info=True, phase=phase, error=e)
+            for match_id, session in due:
+                if game_sessions.get(match_id) is not session:
+                    continue
+                try:
+                    changed = tick_session(match_id, session, now, moves_applied=True)
+                    await finish_tick(match_id, session, now, changed)
+                except Exception as e:
+                    logger.error("tick_error", exc_info=True, match_id=match_id, phase=phase, error=e)
+                    sessions.pop(match_id, None)
+                    continue
+                if not session.idle and idle_every > 1 and now - session.last_input >= IDLE_TICK_AFTER:
+                    session.idle = True
+                    session.wake.clear()
+                if session.state.game_over:
+                    sessions.pop(match_id, None) # Reaped when empty, as with session_tick_loop()
+            duration = time.perf_counter() - started
+            tick_seconds.observe(duration)
+            if late + duration > full_interval:
+                tick_overruns.inc()
+                for _, session in due:
+                    session.tick_stats["overruns"] += 1
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        logger.error("tick_error", exc_info=True, phase=phase, error=e)
+    finally:
+        phase_tasks.pop(phase, None)
+
+async def finish_tick(match_id, session, now, changed):
+    # Record and broadcast the tick tick_session() just ran
+    if changed and session.replay is not None:
+        session.replay.tick(session.tick, now - session.started_at, session.tracker, session.state)
+    keyframe = session.tick - session.last_keyframe_tick >= KEYFRAME_INTERVAL
+    if changed or keyframe:
+        await broadcast_state(match_id, session, keyframe=keyframe)
+
+def stop_session_ticks(session):
+    task = session.tick_task
+    if task and task is not asyncio.current_task():
+        task.cancel()
+    sessions = phase_sessions[session.phase]
+    if sessions.get(session.match_id) is session:
+        del sessions[session.match_id]
+
+
+# --- Master control channel (CONTROL_TOKEN) ---------------------------------
+# JSON text messages on CONTROL_PATH. The master opens one connection per
+# worker and must authenticate first:
+#
+#   master -> server  {"type": "hello", "token": CONTROL_TOKEN}
+#                     {"type": "register_match", "match_id", "players": [username, ...],
+#                      "map" (optional), "tick_rate" (optional, must match TICK_RATE)}
+#   server -> master  {"type": "hello_ack", "worker", "tick_rate", "headroom"}
+#                     {"type": "match_registered", "match_id", "headroom"}
+#                     {"type": "match_rejected", "match_id", "reason", "headroom"}
+#                     {"type": "match_result", "match_id", "winner", "scores": {username: score}}
+#                     {"type": "capacity", "headroom"} every CAPACITY_REPORT_INTERVAL seconds
+#
+# "headroom" is headroom(): the sessions and connections left before the
+# caps (None when uncapped) and whether the server is draining.
+# match_result goes out when the match ends; results for a master that is not
+# connected are kept (up to 1000) and sent when one authenticates.
+
+async def handle_control(websocket):
+    if not CONTROL_TOKEN:
+        await websocket.close(code=1008, reason="Control channel disabled")
+        return
+    try:
+        hello = json.loads(await asyncio.wait_for(websocket.recv(), 10))
+        token = hello.get("token") if isinstance(hello, dict) and hello.get("type") == "hello" else None
+        if not isinstance(token, str) or not hmac.compare_digest(token, CONTROL_TOKEN):
+            logger.warning("control_auth_failed", remote=websocket.remote_address)
+            await websocket.close(code=1008, reason="Authentication failed")
+            return
+        await websocket.send(json.dumps({"type": "hello_ack", "worker": worker_index, "tick_rate": TICK_RATE,
+                                         "headroom": headroom()}))
+        control_links.add(websocket)
+        logger.info("control_connected", remote=websocket.remote_address, worker=worker_index)
+        asyncio.ensure_future(flush_results())
+
+        async for message in websocket:
+            try:
+                data = json.loads(message)
+            except ValueError:
+                logger.warning("control_invalid_message", size=len(message))
+                continue
+            if isinstance(data, dict) and data.get("type") == "register_match":
+                reply = register_match(data)
+                reply["headroom"] = headroom()
+                await websocket.send(json.dumps(reply))
+            else:
+                logger.warning("control_unknown_message", message=str(message)[:100])
+    except (asyncio.TimeoutError, ValueError, websockets.exceptions.ConnectionClosed):
+        pass
+    except Exception as e:
+        logger.error("control_error", exc_info=True, error=e)
+    finally:
+        if websocket in control_links:
+            control_links.discard(websocket)
+            logger.info("control_disconnected", remote=websocket.remote_address)
+
+def register_match(data):
+    # Creates the session for a match the master formed; returns the reply
+    match_id = data.get("match_id")
+    players = data.get("players")
+    def rejected(reason):
+        logger.warning("match_rejected", match_id=match_id, reason=reason)
+        return {"type": "match_rejected", "match_id": match_id, "reason": reason}
+    if (not isinstance(match_id, str) or get_match_id_from_path(f"/game/{match_id}") != match_id
+            or not isinstance(players, list) or not players
+            or not all(isinstance(player, str) and player for player in players)):
+        return rejected("invalid")
+    if draining:
+        return rejected("draining")
+    if sessions_full() and match_id not in game_sessions:
+        return rejected("full")
+    if worker_count > 1 and shard_for_match(match_id, worker_count) != worker_index:
+        return rejected("not_owned")
+    if data.get("tick_rate") not in (None, TICK_RATE):
+        return rejected("tick_rate")
+    expected = frozenset(players)
+    session = game_sessions.get(match_id)
+    if session is not None:
+        # The same registration again (the master retried) is fine
+        return {"type": "match_registered", "match_id": match_id} if session.expected == expected else rejected("exists")
+    try:
+        state = initialize_game_state(data.get("map"))
+    except KeyError:
+        return rejected("unknown_map")
+    session = start_session(match_id, state, MATCH_DURATION)
+    session.expected = expected
+    logger.info("match_registered", match_id=match_id, players=len(expected), map=state.grid.template.name)
+    return {"type": "match_registered", "match_id": match_id}
+
+def report_capacity():
+    # Timer callback: headroom to every connected master, then re-arms
+    message = json.dumps({"type": "capacity", "headroom": headroom()})
+    for link in control_links:
+        asyncio.ensure_future(send_control(link, message))
+    timers.call_later(CAPACITY_REPORT_INTERVAL, report_capacity)
+
+async def send_control(websocket, message):
+    try:
+        await websocket.send(message)
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+async def flush_results():
+    # Sends unreported match results to a connected master, oldest first
+    global flushing_results
+    if flushing_results:
+        return
+    flushing_results = True
+    try:
+        while unreported_results and control_links:
+            link = next(iter(control_links))
+            try:
+                await link.send(json.dumps(unreported_results[0]))
+            except websockets.exceptions.ConnectionClosed:
+                control_links.discard(link)
+                continue
+            unreported_results.popleft()
+    finally:
+        flushing_results = False
+
+
+async def drain():
+    # Stop taking matches, snapshot the live ones and send everyone away with
+    # 1012 (service restart) so clients reconnect to the next process
+    global draining
+    if draining:
+        return
+    draining = True
+    logger.info("drain_started", sessions=len(game_sessions))
+    now = timers.time()
+    blobs = {}
+    for match_id, session in list(game_sessions.items()):
+        stop_session_ticks(session) # Freeze the state before it is captured
+        if SNAPSHOT_DIR and not session.state.game_over and session.state.players:
+            blobs[match_id] = snapshot.encode(snapshot.capture(session, session.ends_at - now))
+    if blobs:
         try:
-            await ws.send(message_json)
-        except websockets.exceptions.ConnectionClosed:
-            print(f"[{timestamp()}] Failed to send to {pid} in {match_id} (closed). Marking for disconnect.")
-            disconnected_players_during_broadcast.append((pid, ws))
-        except Exception as e:
-            print(f"[{timestamp()}] Error sending to {pid} in {match_id}: {e}")
-            # Depending on error, might also mark for disconnect
-
-    for d_pid, d_ws in disconnected_players_during_broadcast:
-        # Check if they haven't already been removed by another disconnect path
-        if d_pid in session["players"] and session["players"][d_pid] == d_ws:
-            await handle_disconnect(d_pid, match_id, d_ws)
-
-
-def initialize_game_state():
-    # TODO: Define your actual initial game state structure
-    return {
-        "grid": [[0]*10 for _ in range(10)], # Example 10x10 grid
-        "players": {}, # player_id: {"score": 0, "position": (x,y)}
-        "gems": [(1,1), (5,5)], # Example gem positions
-        "time_remaining": 60,
-        "game_over": False,
-        "winner": None
-    }
-
-def timestamp():
-    return datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S")
-
-async def game_loop(): # If you need a periodic server-side loop for a game session
-    while True:
-        for match_id, session in list(game_sessions.items()): # Iterate copy
-            if not session["state"]["game_over"]:
-                session["state"]["time_remaining"] -= 1 # Example: decrement time
-                if session["state"]["time_remaining"] <= 0:
-                    session["state"]["game_over"] = True
-                    # Determine winner logic here:
-                    # session["state"]["winner"] = determine_winner(session["state"]["players"])
-                    print(f"[{timestamp()}] Game over for match {match_id}")
-                
-                # Broadcast updated state due to game loop
-                await broadcast_to_session(match_id, {"type": "game_state", "state": session["state"]})
-            
-            # If game over and no players, or some other cleanup condition
-            if session["state"]["game_over"] and not session["players"]:
-                 print(f"[{timestamp()}] Cleaning up finished and empty session {match_id}")
-                 del game_sessions[match_id]
+            await asyncio.to_thread(snapshot.write, SNAPSHOT_DIR, blobs)
+        except OSError as e:
+            logger.error("snapshot_failed", exc_info=True, dir=SNAPSHOT_DIR, error=e)
+            blobs = {}
+    if SNAPSHOT_DIR:
+        logger.info("drain_snapshots_written", snapshots=len(blobs), dir=SNAPSHOT_DIR)
 
-        await asyncio.sleep(1) # Game tick rate (1 second here)
+    closing = [asyncio.ensure_future(websocket.close(code=1012, reason="Server restarting"))
+               for session in game_sessions.values() for websocket in session.players.values()]
+    if closing:
+        # Don't wait out the close handshake of clients that stopped reading
+        await asyncio.wait(closing, timeout=2)
 
+def flush_replays():
+    # Hands buffered replay records to the writer thread, then re-arms
+    replay_log.flush()
+    timers.call_later(REPLAY_FLUSH_INTERVAL, flush_replays)
 
-async def main():
-    print(f"[{timestamp()}] Game server started on ws://localhost:{GAME_SERVER_PORT}") # Use GAME_SERVER_PORT from client.py
-    
-    # If you have a game loop that affects all sessions (like time decrement)
-    # asyncio.create_task(game_loop())
+def restore_sessions():
+    # Load the snapshots this worker owns and delete them, so a match is only
+    # ever restored once. Players get RESTORE_GRACE seconds to rejoin.
+    restored = 0
+    owns = lambda match_id: worker_count == 1 or shard_for_match(match_id, worker_count) == worker_index
+    for path, blob in snapshot.read(SNAPSHOT_DIR, owns):
+        try:
+            data = snapshot.decode(blob)
+            state = snapshot.restore_state(data, DELTA_HISTORY)
+        except (ValueError, KeyError, TypeError, IndexError) as e:
+            logger.warning("snapshot_invalid", path=path, error=e)
+            continue
+        match_id = data["match_id"]
+        session = start_session(match_id, state, data["time_left"], restored_from=data)
+        if data.get("expected") is not None:
+            session.expected = frozenset(data["expected"])
+        session.tick = data["tick"]
+        session.last_keyframe_tick = session.tick
+        for player_id in state.players:
+            session.timers["grace", player_id] = timers.call_later(RESTORE_GRACE, expire_player, match_id,
+                                                                   session, player_id)
+        timers.cancel(session.timers.pop("reap", None))
+        schedule_reap(match_id, session, RESTORE_GRACE)
+        os.remove(path)
+        restored += 1
+        logger.info("session_restored", match_id=match_id, players=len(state.players),
+                    time_left=round(data["time_left"], 1))
+    return restored
+
+async def main(port=None, index=0, workers=1):
+    global worker_index, worker_count, batch_engine
+    worker_index, worker_count = index, workers
+    log.setup_logging()
 
     # The port should match GAME_SERVER_PORT used by client and master
     # Client uses 9001 by default (from its GAME_SERVER_PORT variable)
     # Master.py GAME_PORT is 9001.
     # So game.py should listen on 9001.
-    game_port_to_use = int(os.environ.get("GAME_PORT", 9001)) # Consistent port
+    game_port_to_use = port if port is not None else GAME_SERVER_PORT
+    
+    # Each session runs its own session_tick_loop, started when the session is
+    # created, or with BATCH_ENGINE shares its phase's phase_tick_loop
+    if BATCH_ENGINE:
+        if engine.available():
+            batch_engine = engine.BatchEngine()
+        else:
+            logger.warning("batch_engine_unavailable", reason="numpy is not installed")
+
+    if METRICS_PORT or METRICS_DUMP_INTERVAL > 0:
+        metrics.enable()
+    if METRICS_PORT:
+        await metrics.serve("0.0.0.0", METRICS_PORT + index, session_stats)
+        logger.info("metrics_started", url=f"http://localhost:{METRICS_PORT + index}/metrics", worker=index)
+    dump_task = None
+    if METRICS_DUMP_INTERVAL > 0:
+        # Held until shutdown: the event loop only keeps weak references to tasks
+        dump_task = asyncio.create_task(dump_metrics(METRICS_DUMP_INTERVAL))
+
+    if REPLAY_DIR:
+        flush_replays()
+    if CONTROL_TOKEN and CAPACITY_REPORT_INTERVAL > 0:
+        report_capacity()
+    if SNAPSHOT_DIR:
+        restore_sessions()
+
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    except NotImplementedError: # No signal handlers on Windows event loops
+        pass
+
+    async with serve(handle_player, "0.0.0.0", game_port_to_use, create_protocol=GameServerProtocol,
+                     max_size=MAX_MESSAGE_SIZE) as server:
+        logger.info("server_started", url=f"ws://localhost:{game_port_to_use}", worker=index, workers=workers) # Use GAME_SERVER_PORT from client.py
+        await stop.wait() # run until SIGTERM
+        await drain()
+    if dump_task is not None:
+        dump_task.cancel()
+    if replay_log is not None:
+        for session in game_sessions.values():
+            if session.replay is not None:
+                session.replay.close()
+        await asyncio.to_thread(replay_log.stop)
+    logger.info("server_stopped", worker=index)
+
+def session_stats():
+    # Per-session numbers for the metrics endpoint's /sessions
+    return [{
+        "match_id": match_id,
+        "players": len(session.players),
+        "tick": session.tick,
+        "phase": session.phase,
+        "idle": session.idle,
+        "tick_late_mean": round(session.tick_stats["late_total"] / session.tick, 6) if session.tick else 0,
+        "tick_late_max": round(session.tick_stats["late_max"], 6),
+        "tick_overruns": session.tick_stats["overruns"],
+        "ticks_skipped": session.tick_stats["skipped"],
+        "version": session.tracker.version,
+        "bytes_sent": session.bytes_sent,
+        "frames_sent": session.frames_sent,
+        "send_queue": {pid: outbox.depth for pid, outbox in session.outboxes.items()},
+        "inputs": session.input_stats
+    } for match_id, session in game_sessions.items()]
 
-    async with serve(handle_player, "0.0.0.0", game_port_to_use) as server:
-        print(f"✅ Game server instance running on port {game_port_to_use}")
-        await asyncio.Future()  # run forever
+async def dump_metrics(interval):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("metrics", **metrics.summary())
+
+def run_worker(index, workers):
+    try:
+        asyncio.run(main(GAME_SERVER_PORT + index, index, workers))
+    except KeyboardInterrupt:
+        pass
+
+def run_supervisor(workers):
+    # One process per worker so matches scale with cores. Each worker owns a
+    # disjoint set of match IDs and its own port; a worker that dies is restarted.
+    log.setup_logging()
+    logger.info("supervisor_started", workers=workers, ports=f"{GAME_SERVER_PORT}-{GAME_SERVER_PORT + workers - 1}")
+    procs = {}
+
+    def start(index):
+        proc = multiprocessing.Process(target=run_worker, args=(index, workers), name=f"game-worker-{index}", daemon=True)
+        proc.start()
+        procs[index] = proc
+
+    # Let SIGTERM unwind through the finally below so workers are not orphaned
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    for index in range(workers):
+        start(index)
+    try:
+        while True:
+            time.sleep(1)
+            for index, proc in list(procs.items()):
+                if not proc.is_alive():
+                    logger.warning("worker_restarted", worker=index, exitcode=proc.exitcode)
+                    start(index)
+    except KeyboardInterrupt:
+        logger.info("supervisor_stopping", workers=workers)
+    finally:
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            proc.join(timeout=5)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if GAME_WORKERS > 1:
+        run_supervisor(GAME_WORKERS)
+    else:
+        asyncio.run(main())
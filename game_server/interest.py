@@ -0,0 +1,196 @@
+from delta import build_delta
+
+# Area-of-interest filtering for large maps and crowded matches.
+#
+# With AOI_RADIUS set, each player's game_state frames only carry the
+# players within AOI_RADIUS cells of them (Chebyshev distance, so a square
+# window centred on the player) and the board cells inside that window. The
+# board itself still goes out whole in keyframes, since the client needs the
+# terrain to draw anything.
+#
+# Player positions are indexed in a SpatialGrid of BUCKET_SIZE x BUCKET_SIZE
+# buckets that GameState updates as players join, move and leave, so finding
+# a player's neighbours looks at a few buckets rather than every player.
+#
+# Frames stay deltas against the client's acked version. Each player's view
+# record remembers, for every version sent to it, who it could see, where it
+# stood and which keyframe its board came from. A frame built against base B
+# then adds the full record of players that came into view since B (in any
+# frame sent after it), removes the ones that went out of view, and fills in
+# cells that scrolled into the window and changed after that keyframe.
+
+BUCKET_SIZE = 8
+
+
+class SpatialGrid:
+    __slots__ = ("size", "buckets", "keys")
+
+    def __init__(self, size=BUCKET_SIZE):
+        self.size = size
+        self.buckets = {} # (bx, by): {key: (x, y)}
+        self.keys = {} # key: bucket it is in
+
+    def __len__(self):
+        return len(self.keys)
+
+    def insert(self, key, position):
+        # Also used for moves; only crossing into another bucket touches two buckets
+        bucket = (position[0] // self.size, position[1] // self.size)
+        old = self.keys.get(key)
+        if old != bucket:
+            if old is not None:
+                self._discard(old, key)
+            self.keys[key] = bucket
+            self.buckets.setdefault(bucket, {})[key] = position
+        else:
+            self.buckets[bucket][key] = position
+
+    def remove(self, key):
+        bucket = self.keys.pop(key, None)
+        if bucket is not None:
+            self._discard(bucket, key)
+
+    def _discard(self, bucket, key):
+        members = self.buckets[bucket]
+        del members[key]
+        if not members:
+            del self.buckets[bucket]
+
+    def near(self, position, radius):
+        """Yield the keys within `radius` cells of position on both axes."""
+        x, y = position
+        size = self.size
+        buckets = self.buckets
+        for by in range((y - radius) // size, (y + radius) // size + 1):
+            for bx in range((x - radius) // size, (x + radius) // size + 1):
+                members = buckets.get((bx, by))
+                if members:
+                    for key, (px, py) in members.items():
+                        if abs(px - x) <= radius and abs(py - y) <= radius:
+                            yield key
+
+
+def visible(state, player_id, radius):
+    # (position, visible player_ids); a player no longer in the state sees nobody
+    player = state.players.get(player_id)
+    if player is None:
+        return None, frozenset()
+    return player.position, frozenset(state.spatial.near(player.position, radius))
+
+def window(board, position, radius):
+    # Board cells a player at `position` can see, as (x0, y0, x1, y1) inclusive
+    if position is None:
+        return None
+    x, y = position
+    return (max(0, x - radius), max(0, y - radius),
+            min(board.width - 1, x + radius), min(board.height - 1, y + radius))
+
+def _inside(rect, x, y):
+    return rect is not None and rect[0] <= x <= rect[2] and rect[1] <= y <= rect[3]
+
+
+def keyframe_message(session, view, player_id, radius):
+    # view: {version: (visible player_ids, position, keyframe version)} for
+    # the frames sent to this player; GameSession.views holds one per player
+    tracker = session.tracker
+    state = session.state
+    version = tracker.version
+    position, players = visible(state, player_id, radius)
+    # Earlier entries stay: the client may ack one of them before this arrives
+    for old in [v for v in view if v <= version - tracker.history]:
+        del view[old]
+    view[version] = (players, position, version)
+    wire_state = state.to_wire()
+    wire_state["players"] = {pid: state.players[pid] for pid in players}
+    return {"type": "game_state", "version": version, "keyframe": True, "state": wire_state}
+
+def index_paths(paths):
+    # Splits a delta's paths into {player_id: [paths]} and the rest, so each
+    # player's frame only looks at the players it can see
+    by_player = {}
+    other = []
+    for path in paths:
+        if path[0] == "players" and len(path) > 1:
+            by_player.setdefault(path[1], []).append(path)
+        else:
+            other.append(path)
+    return by_player, other
+
+def state_message(session, view, player_id, base, radius, deltas=None):
+    """The game_state frame for one player at the current version, or None if there is nothing to send.
+
+    `deltas` caches index_paths() of the changes since each base across the
+    players of one broadcast.
+    """
+    tracker = session.tracker
+    state = session.state
+    board = state.grid
+    version = tracker.version
+    known = view.get(base) if base is not None else None
+    delta = None
+    if known is not None:
+        if deltas is None:
+            deltas = {}
+        if base not in deltas:
+            paths = tracker.delta_since(base)
+            deltas[base] = None if paths is None else index_paths(paths)
+        delta = deltas[base]
+    if delta is None:
+        return keyframe_message(session, view, player_id, radius)
+    by_player, other = delta
+    if not by_player and not other:
+        return None
+
+    position, players = visible(state, player_id, radius)
+    seen, seen_position, since = known
+    # Frames sent after base may be applied before this one arrives, so the
+    # client holds the players of any view from base on. Players in all of
+    # them only need their changes; the rest go out whole, and players in
+    # any of them that are out of view now are removed.
+    seen_always = seen_ever = seen
+    for sent, entry in view.items():
+        if sent > base:
+            seen_always = seen_always & entry[0]
+            seen_ever = seen_ever | entry[0]
+    rect = window(board, position, radius)
+    width = board.width
+    kept = []
+    for pid in players & seen_always:
+        changed = by_player.get(pid)
+        if changed:
+            kept += changed
+    for path in other:
+        if path[0] == "grid" and len(path) == 3 and not _inside(rect, path[2] % width, path[2] // width):
+            continue
+        kept.append(path)
+    changes, removed = build_delta(state, kept)
+    for pid in players - seen_always:
+        changes.append([["players", pid], state.players[pid]])
+    for pid in seen_ever - players:
+        removed.append(["players", pid])
+
+    if rect is not None and position != seen_position:
+        # Cells new to the window that changed after the client's keyframe
+        # but not after `base` (those are already in `kept` if visible).
+        # Walks whichever is smaller, the window or the changed cells.
+        old_rect = window(board, seen_position, radius)
+        cell_versions = state.cell_versions
+        if len(cell_versions) > (rect[2] - rect[0] + 1) * (rect[3] - rect[1] + 1):
+            indexes = [y * width + x for y in range(rect[1], rect[3] + 1) for x in range(rect[0], rect[2] + 1)]
+        else:
+            indexes = list(cell_versions)
+        for index in indexes:
+            changed = cell_versions.get(index)
+            if changed is not None and since < changed <= base:
+                x, y = index % width, index // width
+                if _inside(rect, x, y) and not _inside(old_rect, x, y):
+                    changes.append([["grid", "cells", index], board.cells[index]])
+
+    if not changes and not removed and version - base < tracker.history // 2:
+        # Nothing in view changed. Skip the frame, but not for so long that
+        # the client's acked version falls out of the history.
+        return None
+    for old in [v for v in view if v < base]:
+        del view[old] # The client has acked base; older versions are never a base again
+    view[version] = (players, position, since)
+    return {"type": "game_state", "version": version, "base": base, "changes": changes, "removed": removed}
@@ -0,0 +1,155 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+# Structured, asynchronous logging for the game server.
+#
+# Call sites log an event name plus fields:
+#
+#     logger = log.get_logger("game")
+#     logger.info("player_joined", match_id=match_id, player_id=player_id)
+#
+# The call only checks the level and sampling rate and puts the record on a
+# queue; a background QueueListener thread does the formatting and the
+# stdout write. Configuration comes from the environment:
+#
+#   LOG_LEVEL   DEBUG, INFO, WARNING, ... (default INFO). Per-move events are
+#               DEBUG, so they cost a level check and nothing else by default.
+#   LOG_FORMAT  "text" (default) or "json" (one object per line)
+#   LOG_SAMPLE  per-event sampling, e.g. "player_move=0.01,input_dropped=0.1"
+#   LOG_QUEUE   max records waiting for the writer thread (default 10000);
+#               records past that are dropped and counted, never blocking
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_QUEUE = int(os.environ.get("LOG_QUEUE", 10000))
+
+def _parse_sample_rates(spec):
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        event, _, rate = item.partition("=")
+        try:
+            rates[event.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            print(f"Ignoring invalid LOG_SAMPLE entry: {item!r}", file=sys.stderr)
+    return rates
+
+sample_rates = _parse_sample_rates(os.environ.get("LOG_SAMPLE", ""))
+dropped_records = 0 # Records dropped because the queue was full
+
+_listener = None
+_listener_pid = None
+
+
+class EventLogger:
+    __slots__ = ("logger",)
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def enabled(self, level, event):
+        # For call sites that want to skip building expensive fields
+        return self.logger.isEnabledFor(level) and event_sampled(event)
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, exc_info=False, **fields):
+        self._log(logging.ERROR, event, fields, exc_info)
+
+    def _log(self, level, event, fields, exc_info=False):
+        if not self.logger.isEnabledFor(level) or not event_sampled(event):
+            return
+        self.logger.log(level, event, exc_info=exc_info, extra={"fields": fields}, stacklevel=3)
+
+
+def event_sampled(event):
+    rate = sample_rates.get(event)
+    return rate is None or (rate > 0 and (rate >= 1 or random.random() < rate))
+
+def get_logger(name):
+    return EventLogger(name)
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, fmt="text"):
+        super().__init__()
+        self.json = fmt == "json"
+
+    def format(self, record):
+        fields = getattr(record, "fields", None) or {}
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(record.created))
+        ts = f"{ts}.{int(record.msecs):03d}"
+        if self.json:
+            entry = {"ts": ts, "level": record.levelname, "logger": record.name, "event": record.getMessage()}
+            entry.update(fields)
+            if record.exc_text:
+                entry["exc"] = record.exc_text
+            return json.dumps(entry, default=str)
+        parts = [f"[{ts}] {record.levelname} {record.name} {record.getMessage()}"]
+        parts.extend(f"{key}={value}" for key, value in fields.items())
+        line = " ".join(parts)
+        if record.exc_text:
+            line = f"{line}\n{record.exc_text}"
+        return line
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # The stock QueueHandler formats the message in the calling thread; this
+    # one only renders tracebacks (which cannot cross threads) and leaves the
+    # rest of the formatting to the listener thread
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records += 1
+
+
+def setup_logging(level=None, fmt=None):
+    """Route the root logger through a background writer thread. Call once per process."""
+    global _listener, _listener_pid
+    if _listener is not None and _listener_pid == os.getpid():
+        return
+    # After a fork the parent's listener thread does not exist in the child
+    records = queue.Queue(maxsize=LOG_QUEUE)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(StructuredFormatter(fmt or LOG_FORMAT))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(records))
+    root.setLevel(level or LOG_LEVEL)
+    # websockets logs every connection at INFO and every frame at DEBUG
+    logging.getLogger("websockets").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=False)
+    _listener.start()
+    _listener_pid = os.getpid()
+    atexit.register(_stop_listener)
+
+def _stop_listener():
+    # Flush what is queued on normal interpreter exit
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        _listener = None
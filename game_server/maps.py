@@ -0,0 +1,103 @@
+import json
+import os
+import random
+
+from board import EMPTY, GEM, WALL
+
+# Map registry. Every map is built or loaded once into an immutable
+# MapTemplate and shared read-only by all sessions playing it; sessions only
+# keep a copy-on-write overlay of the cells they change (see board.py).
+#
+# Map files are JSON: {"name": "arena", "rows": ["#####", "#S.G#", ...]} with
+# "." empty, "G" gem, "#" wall and "S" a spawn point (an empty cell).
+
+CELL_CHARS = {".": EMPTY, "G": GEM, "#": WALL, "S": EMPTY}
+
+
+class MapTemplate:
+    __slots__ = ("name", "width", "height", "cells", "spawns")
+
+    def __init__(self, name, width, height, cells, spawns=()):
+        if width <= 0 or height <= 0 or width * height > 0xffffff:
+            raise ValueError(f"Unsupported map size {width}x{height} for {name}")
+        if len(cells) != width * height:
+            raise ValueError(f"Map {name} has {len(cells)} cells, expected {width * height}")
+        self.name = name
+        self.width = width
+        self.height = height
+        self.cells = bytes(cells)
+        self.spawns = tuple(spawns) or ((0, 0),)
+
+
+maps = {} # name: MapTemplate
+
+def register_map(template):
+    maps[template.name] = template
+    return template
+
+def get_map(name):
+    template = maps.get(name)
+    if template is None:
+        raise KeyError(f"Unknown map: {name}")
+    return template
+
+
+def parse_rows(name, rows):
+    height = len(rows)
+    width = len(rows[0]) if rows else 0
+    cells = bytearray()
+    spawns = []
+    for y, row in enumerate(rows):
+        if len(row) != width:
+            raise ValueError(f"Map {name}: row {y} has {len(row)} cells, expected {width}")
+        for x, char in enumerate(row):
+            if char not in CELL_CHARS:
+                raise ValueError(f"Map {name}: unknown cell {char!r} at ({x}, {y})")
+            if char == "S":
+                spawns.append((x, y))
+            cells.append(CELL_CHARS[char])
+    return MapTemplate(name, width, height, cells, spawns)
+
+def load_maps(directory):
+    # Loads every *.json map in directory; returns the number loaded
+    loaded = 0
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".json"):
+            continue
+        with open(os.path.join(directory, filename), encoding="utf-8") as f:
+            data = json.load(f)
+        name = data.get("name") or filename[:-len(".json")]
+        register_map(parse_rows(name, data["rows"]))
+        loaded += 1
+    return loaded
+
+
+def generate_map(name, width, height, gems=(), gem_density=0.0, walls=False, seed=0):
+    # Builds a template in code: optional border walls, fixed gem cells and a
+    # seeded scatter of extra gems, with spawns in the corners
+    cells = bytearray(width * height)
+    if walls and width > 2 and height > 2:
+        for x in range(width):
+            cells[x] = cells[(height - 1) * width + x] = WALL
+        for y in range(height):
+            cells[y * width] = cells[y * width + width - 1] = WALL
+    inset = 1 if walls and width > 2 and height > 2 else 0
+    for x, y in gems:
+        if 0 <= x < width and 0 <= y < height and cells[y * width + x] == EMPTY:
+            cells[y * width + x] = GEM
+    spawns = [(inset, inset), (width - 1 - inset, height - 1 - inset),
+              (width - 1 - inset, inset), (inset, height - 1 - inset)]
+    if gem_density:
+        rng = random.Random(seed)
+        spawn_cells = {y * width + x for x, y in spawns}
+        for index in range(width * height):
+            if cells[index] == EMPTY and index not in spawn_cells and rng.random() < gem_density:
+                cells[index] = GEM
+    return MapTemplate(name, width, height, cells, spawns)
+
+
+def register_builtin_maps(width=10, height=10):
+    # "default" keeps the original example board: open grid, gems at (1,1) and (5,5)
+    register_map(generate_map("default", width, height, gems=[(1, 1), (5, 5)]))
+    register_map(generate_map("arena", 64, 64, gem_density=0.05, walls=True, seed=1))
+    register_map(generate_map("expanse", 256, 256, gem_density=0.02, walls=True, seed=2))
@@ -0,0 +1,173 @@
+import asyncio
+import bisect
+import json
+import math
+
+# Opt-in metrics for the game server hot paths.
+#
+# Instruments are module-level objects updated from the event loop thread.
+# Nothing is recorded until enable() is called, so a server without
+# METRICS_PORT / METRICS_DUMP_INTERVAL pays one flag check per observation.
+# serve() exposes the registry over HTTP:
+#
+#   GET /metrics       Prometheus text format
+#   GET /metrics.json  the same data as JSON
+#   GET /sessions      per-session stats from the provider given to serve()
+#
+# summary() flattens the registry for periodic dumps through the logger.
+
+enabled = False
+registry = []
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+class Counter:
+    # A monotonically increasing count, optionally split by one label
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {} # label value (None without a label): count
+        registry.append(self)
+
+    def inc(self, amount=1, label_value=None):
+        if enabled:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def samples(self):
+        for label_value, value in self.values.items():
+            yield self.name, self._labels(label_value), value
+
+    def _labels(self, label_value):
+        return {self.label: label_value} if self.label else {}
+
+
+class Gauge(Counter):
+    # A value read when metrics are collected, from a callback or set()
+    def __init__(self, name, help, label=None, callback=None):
+        super().__init__(name, help, label)
+        self.callback = callback # returns a number, or {label value: number}
+
+    def set(self, value, label_value=None):
+        if enabled:
+            self.values[label_value] = value
+
+    def samples(self):
+        if self.callback is not None:
+            result = self.callback()
+            values = result if isinstance(result, dict) else {None: result}
+        else:
+            values = self.values
+        for label_value, value in values.items():
+            yield self.name, self._labels(label_value), value
+
+
+class Histogram(Counter):
+    # Fixed-bucket histogram; observe() is a bisect and two additions
+    def __init__(self, name, help, buckets, label=None):
+        super().__init__(name, help, label)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, label_value=None):
+        if not enabled:
+            return
+        series = self.values.get(label_value)
+        if series is None:
+            # [per-bucket counts (+Inf last), sum, count]
+            series = self.values[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        for label_value, (counts, total, count) in self.values.items():
+            labels = self._labels(label_value)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                yield f"{self.name}_bucket", dict(labels, le=le), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+def _kind(metric):
+    if isinstance(metric, Histogram):
+        return "histogram"
+    if isinstance(metric, Gauge):
+        return "gauge"
+    return "counter"
+
+def render_text():
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {_kind(metric)}")
+        for name, labels, value in metric.samples():
+            if labels:
+                rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{rendered}}} {value}")
+            else:
+                lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def snapshot():
+    # {metric name: [{"labels": {...}, "value": v}, ...]} for JSON output and dumps
+    result = {}
+    for metric in registry:
+        for name, labels, value in metric.samples():
+            result.setdefault(name, []).append({"labels": labels, "value": value})
+    return result
+
+def summary():
+    # Flat {name[label]: value} for periodic log dumps; histograms are reduced
+    # to their count and mean
+    result = {}
+    for metric in registry:
+        if isinstance(metric, Histogram):
+            for label_value, (counts, total, count) in metric.values.items():
+                key = metric.name if label_value is None else f"{metric.name}[{label_value}]"
+                result[f"{key}.count"] = count
+                result[f"{key}.mean"] = round(total / count, 6) if count else 0
+            continue
+        for name, labels, value in metric.samples():
+            label_value = next(iter(labels.values()), None)
+            result[name if label_value is None else f"{name}[{label_value}]"] = value
+    return result
+
+
+async def serve(host, port, sessions_provider=None):
+    """Start the metrics HTTP endpoint; returns the asyncio server."""
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain headers; the endpoint only looks at the request line
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+            parts = request_line.decode("latin-1").split()
+            path = parts[1] if len(parts) >= 2 else "/"
+            if path == "/metrics":
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4", render_text()
+            elif path == "/metrics.json":
+                status, content_type, body = "200 OK", "application/json", json.dumps(snapshot())
+            elif path == "/sessions" and sessions_provider is not None:
+                status, content_type, body = "200 OK", "application/json", json.dumps(sessions_provider(), default=str)
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", "not found\n"
+            data = body.encode("utf-8")
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
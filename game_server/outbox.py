@@ -0,0 +1,104 @@
+import asyncio
+import time
+from collections import deque
+
+import websockets
+
+# Per-connection outbound queue. Broadcasts only enqueue frames; each
+# connection's own writer task drains its queue, so a slow or stalled client
+# delays nobody but itself.
+#
+# game_state frames are latest-wins: a new one replaces a queued one that has
+# not been written yet (every frame is built against the client's acked
+# version, so the newer frame alone is enough). Other frames keep their order.
+# A connection is disconnected as a slow consumer when its queue stays over
+# budget for longer than slow_after seconds, when it hits the hard limit, or
+# when a single write has been stuck for slow_after seconds.
+
+
+class Outbox:
+    def __init__(self, websocket, name, max_frames=32, slow_after=5.0, on_slow=None):
+        self.websocket = websocket
+        self.name = name
+        self.max_frames = max_frames # soft budget of queued frames
+        self.hard_limit = max_frames * 4 # disconnect immediately past this
+        self.slow_after = slow_after
+        self.on_slow = on_slow # called with the Outbox when it is dropped as too slow
+        self.queue = deque() # [frame] entries; frame is None once superseded
+        self.depth = 0 # live (not superseded) frames in queue
+        self.pending_state = None # queued game_state entry that a newer one replaces
+        self.superseded = 0 # game_state frames dropped because a newer one replaced them
+        self.over_since = None # when depth first went over max_frames
+        self.sending_since = None # when the write in progress started
+        self.closed = False
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._writer())
+
+    def send(self, frame, state=False):
+        """Queue a frame without waiting. Returns False if the connection was dropped."""
+        if self.closed:
+            return False
+        if state and self.pending_state is not None:
+            # Drop the unsent game_state; the new one goes to the back so it
+            # stays ordered after any events queued in between
+            self.pending_state[0] = None
+            self.depth -= 1
+            self.superseded += 1
+
+        entry = [frame]
+        self.queue.append(entry)
+        self.depth += 1
+        if state:
+            self.pending_state = entry
+        self.wakeup.set()
+
+        if self.depth > self.max_frames or self.sending_since is not None:
+            now = time.monotonic()
+            if self.depth > self.max_frames and self.over_since is None:
+                self.over_since = now
+            if (self.depth > self.hard_limit
+                    or (self.over_since is not None and now - self.over_since > self.slow_after)
+                    or (self.sending_since is not None and now - self.sending_since > self.slow_after)):
+                self._drop_slow()
+                return False
+        return True
+
+    def close(self):
+        # Stop writing; the websocket itself is closed by its handler
+        self.closed = True
+        self.queue.clear()
+        self.depth = 0
+        self.pending_state = None
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    def _drop_slow(self):
+        if self.on_slow:
+            self.on_slow(self)
+        self.close()
+        # close() waits for the closing handshake, which a stalled client may
+        # never complete; websockets aborts the connection after close_timeout
+        asyncio.ensure_future(self.websocket.close(code=1008, reason="Slow consumer"))
+
+    async def _writer(self):
+        try:
+            while True:
+                while not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                entry = self.queue.popleft()
+                if entry[0] is None: # Superseded game_state
+                    continue
+                if entry is self.pending_state:
+                    self.pending_state = None
+                self.depth -= 1
+                self.sending_since = time.monotonic()
+                await self.websocket.send(entry[0])
+                self.sending_since = None
+                if self.depth <= self.max_frames:
+                    self.over_since = None
+        except asyncio.CancelledError:
+            pass
+        except websockets.exceptions.ConnectionClosed:
+            # The handler's receive loop sees the same close and cleans up
+            self.close()
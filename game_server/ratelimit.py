@@ -0,0 +1,26 @@
+import time
+
+# Token bucket used to cap how fast one player's inputs are accepted. Tokens
+# refill continuously at `rate` per second up to `burst`; each accepted
+# message spends one.
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def allow(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        tokens = self.tokens + (now - self.updated) * self.rate
+        self.updated = now
+        if tokens >= 1.0:
+            self.tokens = min(tokens, self.burst) - 1.0
+            return True
+        self.tokens = min(tokens, self.burst)
+        return False
@@ -0,0 +1,188 @@
+import os
+import queue
+import threading
+import time
+
+import zlib
+
+from delta import build_delta
+import log
+import wire
+
+# Append-only replay logs, one file per match, for debugging desyncs and
+# replaying real traffic offline (see replay_tool.py).
+#
+# A log is MAGIC followed by records, each a varint byte length and one bin1
+# tagged value (see wire.py) holding a list that starts with the record kind:
+#
+#   [START, header]                 header: match_id, map, duration, tick_rate,
+#                                   snapshot (restored matches, see snapshot.py)
+#   [JOIN, tick, index, player_id]  players are referred to by index afterwards
+#   [LEAVE, tick, index]
+#   [INPUTS, tick, [index, direction, seq, ...]]  moves applied in `tick`, in order
+#   [TICK, tick, elapsed, digest]   a tick that changed the state; elapsed is
+#                                   seconds since START, digest a crc32 of the
+#                                   changes since the previous TICK (digest())
+#   [END, tick, elapsed]            the match-end timer fired after `tick`
+#
+# Recording only appends to an in-memory buffer. flush() hands the filled
+# buffers to one writer thread per process, so the event loop never waits on
+# the disk.
+
+MAGIC = b"GRL2"
+START, JOIN, LEAVE, INPUTS, TICK, END = range(6)
+SUFFIX = ".replay"
+
+logger = log.get_logger("replay")
+
+
+def _write_varint(n, out):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def read_records(blob):
+    """Yield the records of a replay log. Raises ValueError on a bad header."""
+    if not blob.startswith(MAGIC):
+        raise ValueError("Not a replay log")
+    offset = len(MAGIC)
+    while offset < len(blob):
+        length = shift = 0
+        while True:
+            b = blob[offset]
+            offset += 1
+            length |= (b & 0x7f) << shift
+            if not b & 0x80:
+                break
+            shift += 7
+        if offset + length > len(blob):
+            return # Torn last record (process died mid-write)
+        record, _ = wire.decode_value(blob[offset:offset + length])
+        offset += length
+        yield record
+
+
+def digest(tracker, state, base):
+    # crc32 of the changes after version `base`, in a canonical order so the
+    # live server and replay_tool.py agree. None if the tracker no longer has
+    # that far back (or there is no base yet).
+    paths = tracker.delta_since(base) if base is not None else None
+    if paths is None:
+        return None
+    changes, removed = build_delta(state, sorted(paths, key=repr))
+    out = bytearray()
+    wire.encode_value([changes, removed], out)
+    return zlib.crc32(out)
+
+
+class ReplayWriter:
+    __slots__ = ("replay_log", "path", "buffer", "scratch", "players", "version", "closed")
+
+    def __init__(self, replay_log, path, header):
+        self.replay_log = replay_log
+        self.path = path
+        self.buffer = bytearray(MAGIC)
+        self.scratch = bytearray()
+        self.players = {} # player_id: index used in records
+        self.version = None # state version at the last TICK record
+        self.closed = False
+        self.record([START, header])
+
+    def record(self, record):
+        if self.closed:
+            return
+        scratch = self.scratch
+        scratch.clear()
+        wire.encode_value(record, scratch)
+        _write_varint(len(scratch), self.buffer)
+        self.buffer += scratch
+        self.replay_log.dirty.add(self)
+
+    def join(self, tick, player_id):
+        index = self.players.setdefault(player_id, len(self.players))
+        self.record([JOIN, tick, index, player_id])
+
+    def leave(self, tick, player_id):
+        index = self.players.get(player_id)
+        if index is not None:
+            self.record([LEAVE, tick, index])
+
+    def inputs(self, tick, moves):
+        flat = []
+        for player_id, (direction, seq) in moves.items():
+            index = self.players.get(player_id)
+            if index is not None:
+                flat.append(index)
+                flat.append(direction)
+                flat.append(seq)
+        self.record([INPUTS, tick, flat])
+
+    def tick(self, tick, elapsed, tracker, state):
+        # Commits pending changes; the broadcast that follows sends the same version
+        version = tracker.commit()
+        self.record([TICK, tick, elapsed, digest(tracker, state, self.version)])
+        self.version = version
+
+    def end(self, tick, elapsed):
+        self.record([END, tick, elapsed])
+
+    def close(self):
+        # Flushed and closed by the next ReplayLog.flush()
+        self.closed = True
+        self.replay_log.dirty.add(self)
+
+
+class ReplayLog:
+    def __init__(self, directory):
+        self.directory = directory
+        self.dirty = set() # writers with unflushed records
+        self.queue = queue.SimpleQueue() # (path, data, close) for the writer thread; None stops it
+        self.thread = None
+        self.bytes_written = 0 # updated by the writer thread
+
+    def open(self, match_id, header):
+        # match_id comes from the URL path; hex keeps it a safe file name
+        name = f"{str(match_id).encode('utf-8').hex()}-{int(time.time() * 1000)}{SUFFIX}"
+        return ReplayWriter(self, os.path.join(self.directory, name), header)
+
+    def flush(self):
+        for writer in self.dirty:
+            data = bytes(writer.buffer)
+            writer.buffer.clear()
+            self.queue.put((writer.path, data, writer.closed))
+        self.dirty.clear()
+        if self.thread is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.thread = threading.Thread(target=self._run, name="replay-writer", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=5):
+        # Write out everything buffered, then stop the thread
+        self.flush()
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def _run(self):
+        files = {} # path: open file, kept until its writer is closed
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, data, close = item
+            try:
+                f = files.get(path)
+                if f is None:
+                    f = files[path] = open(path, "ab")
+                f.write(data)
+                self.bytes_written += len(data)
+                if close:
+                    files.pop(path).close()
+                elif self.queue.empty():
+                    # Batch done; hand it to the OS so a crash loses at most one interval
+                    for f in files.values():
+                        f.flush()
+            except OSError as e:
+                logger.error("replay_write_failed", path=path, error=e)
+        for f in files.values():
+            f.close()
@@ -0,0 +1,114 @@
+import argparse
+import math
+import sys
+
+import game
+import rules
+import snapshot
+from replay import read_records, digest, START, JOIN, LEAVE, INPUTS, TICK, END
+from session import GameSession
+
+# Re-simulates a match from a replay log written with REPLAY_DIR set (see
+# replay.py), through the same tick_session()/apply_input() code the server
+# runs, and checks every recorded tick digest against the re-simulated one.
+#
+#     python game_server/replay_tool.py REPLAY_DIR/<match>.replay [--verbose] [--profile]
+#
+# Exits with status 1 if any tick diverged. --profile prints the match's
+# inputs per second, for reproducing its load offline.
+
+
+def replay(blob, verbose=False):
+    records = read_records(blob)
+    kind, header = next(records)
+    if kind != START:
+        raise ValueError("Replay log does not start with a START record")
+    match_id = header["match_id"]
+    if header["snapshot"]:
+        state = snapshot.restore_state(header["snapshot"], game.DELTA_HISTORY)
+    else:
+        state = game.initialize_game_state(header["map"])
+        state.time_remaining = max(1, math.ceil(header["duration"]))
+    session = GameSession(match_id, state)
+    session.started_at = 0.0
+    session.ends_at = header["duration"]
+    tracker = state.tracker
+    base = tracker.version
+
+    players = {} # index: player_id
+    result = {"match_id": match_id, "ticks": 0, "inputs": 0, "matched": 0, "unchecked": 0, "diverged": [],
+              "inputs_per_second": {}}
+    pending_tick = None # tick the moves in session.pending_moves belong to
+
+    for record in records:
+        kind = record[0]
+        if kind != TICK and pending_tick is not None:
+            # That tick changed nothing (e.g. every mover had left), so it was not recorded
+            session.pending_moves = {}
+            pending_tick = None
+        if kind == JOIN:
+            _, tick, index, player_id = record
+            players[index] = player_id
+            state.add_player(player_id, rules.spawn_position(state))
+        elif kind == LEAVE:
+            state.remove_player(players[record[2]])
+        elif kind == INPUTS:
+            _, tick, flat = record
+            session.pending_moves = {players[flat[i]]: (flat[i + 1], flat[i + 2]) for i in range(0, len(flat), 3)}
+            pending_tick = tick
+        elif kind == TICK:
+            _, tick, elapsed, expected = record
+            if pending_tick != tick:
+                session.pending_moves = {}
+            moves = len(session.pending_moves)
+            pending_tick = None
+            session.tick = tick - 1
+            game.tick_session(match_id, session, elapsed)
+            version = tracker.commit()
+            actual = digest(tracker, state, base)
+            base = version
+            result["ticks"] += 1
+            result["inputs"] += moves
+            second = int(elapsed)
+            result["inputs_per_second"][second] = result["inputs_per_second"].get(second, 0) + moves
+            if expected is None or actual is None:
+                result["unchecked"] += 1
+            elif expected == actual:
+                result["matched"] += 1
+            else:
+                result["diverged"].append(tick)
+                if verbose:
+                    print(f"tick {tick}: digest {actual:#010x}, recorded {expected:#010x}")
+        elif kind == END:
+            game.end_match(match_id, session)
+        if verbose and kind != TICK:
+            print(f"record {record}")
+
+    result["final"] = {"players": {pid: player.to_wire() for pid, player in state.players.items()},
+                       "time_remaining": state.time_remaining, "game_over": state.game_over,
+                       "winner": state.winner}
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-simulate a match from its replay log")
+    parser.add_argument("path")
+    parser.add_argument("--verbose", action="store_true", help="print every record and each divergence")
+    parser.add_argument("--profile", action="store_true", help="print inputs per second")
+    args = parser.parse_args(argv)
+
+    with open(args.path, "rb") as f:
+        result = replay(f.read(), args.verbose)
+
+    print(f"match {result['match_id']}: {result['ticks']} ticks, {result['inputs']} inputs, "
+          f"{result['matched']} matched, {result['unchecked']} unchecked, {len(result['diverged'])} diverged")
+    if result["diverged"]:
+        print(f"first divergence at tick {result['diverged'][0]}")
+    print(f"final: {result['final']}")
+    if args.profile:
+        for second, count in sorted(result["inputs_per_second"].items()):
+            print(f"{second:5d}s {count:6d} inputs")
+    return 1 if result["diverged"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+from board import EMPTY, GEM, WALL
+
+# Server-authoritative rules of the grid game. Clients only send directions;
+# everything that follows from a move is decided here:
+#
+#   - a move is one cell; off the board or into a wall it is refused
+#   - a cell holds one player: moving into an occupied cell is refused, so
+#     when two players go for the same cell in one tick the first input wins
+#   - entering a gem cell collects it (the cell becomes empty) for GEM_POINTS
+#   - when the match ends the highest score wins; a tie has no winner
+#
+# Every check is a lookup by position, on the board's cells and on the
+# state's occupancy index (GameState.occupants), so applying an input costs
+# the same however many players or gems the match has.
+
+GEM_POINTS = 1
+MOVES = {"up": (0, -1), "down": (0, 1), "left": (-1, 0), "right": (1, 0)}
+
+
+def spawn_position(state):
+    # The map's spawn points in turn, skipping occupied ones. If all are
+    # taken, the first free cell in reading order (join-time only).
+    spawns = state.grid.template.spawns
+    first = len(state.players) % len(spawns)
+    for i in range(len(spawns)):
+        position = spawns[(first + i) % len(spawns)]
+        if position not in state.occupants:
+            return position
+    board = state.grid
+    for position in board.positions(EMPTY):
+        if position not in state.occupants:
+            return position
+    return spawns[first] # Board full; share a spawn
+
+def move(state, player_id, direction):
+    """Apply one move. Returns False if the input is not a move this player can make at all."""
+    player = state.players.get(player_id)
+    step = MOVES.get(direction) if isinstance(direction, str) else None
+    if player is None or step is None: # Left before the tick ran, or not a direction
+        return False
+    x, y = player.position[0] + step[0], player.position[1] + step[1]
+    board = state.grid
+    if board.in_bounds(x, y):
+        cell = board.get(x, y)
+        if cell != WALL and (x, y) not in state.occupants:
+            state.move_player(player_id, (x, y))
+            if cell == GEM:
+                state.set_cell(x, y, EMPTY)
+                state.add_score(player_id, GEM_POINTS)
+    # A blocked move still counts as the player's move this tick
+    state.set("last_move_by", player_id)
+    state.set("last_direction", direction)
+    return True
+
+def pick_winner(state):
+    # Highest score; None when nobody played or the top score is shared
+    best = None
+    winner = None
+    for player_id, player in state.players.items():
+        if best is None or player.score > best:
+            best = player.score
+            winner = player_id
+        elif player.score == best:
+            winner = None
+    return winner
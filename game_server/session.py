@@ -0,0 +1,176 @@
+import asyncio
+
+from delta import StateTracker
+from interest import SpatialGrid
+
+# Typed per-match state. A GameSession holds the connection-side bookkeeping
+# for one match and its GameState; the GameState holds what players see.
+#
+# GameState mutators record the path they change on the session's
+# StateTracker, so code that goes through them gets delta tracking for free.
+# Paths are the same as on the wire: ("players", pid, "position"),
+# ("grid", "cells", index), ("time_remaining",), ... and delta.read_path
+# walks these objects by attribute. Player positions are also kept in a
+# spatial index for area-of-interest filtering (see interest.py).
+#
+# Keyframes are encoded once per state version and codec and reused for
+# every player that needs one at that version (joins, resyncs, players too
+# far behind), see GameSession.keyframe_frames().
+
+
+class PlayerState:
+    __slots__ = ("score", "position", "seq")
+
+    def __init__(self, position=(0, 0), score=0):
+        self.score = score
+        self.position = position
+        self.seq = 0 # sequence number of the player's last processed move, for client-side prediction
+
+    def to_wire(self):
+        return {"score": self.score, "position": self.position, "seq": self.seq}
+
+
+class GameState:
+    __slots__ = ("tracker", "grid", "players", "time_remaining", "game_over", "winner",
+                 "last_move_by", "last_direction", "spatial", "occupants", "cell_versions", "batch")
+
+    def __init__(self, board, tracker, time_remaining=60):
+        self.tracker = tracker
+        self.grid = board # Cell codes (board.EMPTY/GEM/WALL); changes are tracked as ("grid", "cells", index)
+        self.players = {} # player_id: PlayerState
+        self.time_remaining = time_remaining
+        self.game_over = False
+        self.winner = None
+        self.last_move_by = None
+        self.last_direction = None
+        self.spatial = SpatialGrid() # player_id by position, updated by the player mutators
+        self.occupants = {} # (x, y): player_id standing there, for collision checks (see rules.py)
+        self.cell_versions = {} # cell index: state version that last changed it
+        self.batch = None # engine.Block mirroring cells and occupants, when BATCH_ENGINE is on
+
+    def set(self, field, value):
+        # Top-level field update; returns True if the value changed
+        if getattr(self, field) == value:
+            return False
+        setattr(self, field, value)
+        self.tracker.touch(field)
+        return True
+
+    def add_player(self, player_id, position=(0, 0)):
+        player = self.players.get(player_id)
+        if player is None:
+            player = self.players[player_id] = PlayerState(position)
+            self.spatial.insert(player_id, position)
+            self._occupy(player_id, position)
+            self.tracker.touch("players", player_id)
+        return player
+
+    def remove_player(self, player_id):
+        player = self.players.pop(player_id, None)
+        if player is not None:
+            self._vacate(player_id, player.position)
+            self.spatial.remove(player_id)
+            self.tracker.touch("players", player_id)
+
+    def move_player(self, player_id, position):
+        player = self.players[player_id]
+        if player.position != position:
+            self._vacate(player_id, player.position)
+            self._occupy(player_id, position)
+            player.position = position
+            self.spatial.insert(player_id, position)
+            self.tracker.touch("players", player_id, "position")
+
+    def _occupy(self, player_id, position):
+        if position not in self.occupants:
+            self.occupants[position] = player_id
+            if self.batch is not None:
+                self.batch.set_occupied(position, 1)
+
+    def _vacate(self, player_id, position):
+        if self.occupants.get(position) == player_id:
+            del self.occupants[position]
+            if self.batch is not None:
+                self.batch.set_occupied(position, 0)
+
+    def set_seq(self, player_id, seq):
+        player = self.players.get(player_id)
+        if player is not None and player.seq != seq:
+            player.seq = seq
+            self.tracker.touch("players", player_id, "seq")
+
+    def add_score(self, player_id, points):
+        if points:
+            self.players[player_id].score += points
+            self.tracker.touch("players", player_id, "score")
+
+    def set_cell(self, x, y, code):
+        index = self.grid.set(x, y, code)
+        if self.batch is not None:
+            self.batch.set_cell(index, code)
+        self.cell_versions[index] = self.tracker.version + 1 # the version this change is committed as
+        self.tracker.touch("grid", "cells", index)
+
+    def to_wire(self):
+        return {
+            "grid": self.grid,
+            "players": self.players,
+            "time_remaining": self.time_remaining,
+            "game_over": self.game_over,
+            "winner": self.winner,
+            "last_move_by": self.last_move_by,
+            "last_direction": self.last_direction
+        }
+
+
+class GameSession:
+    __slots__ = ("match_id", "state", "tracker", "players", "pending_moves", "buckets", "input_stats",
+                 "tick", "phase", "tick_stats", "idle", "last_input", "wake", "ends_at", "tick_task", "acked", "codecs", "outboxes", "last_keyframe_tick",
+                 "views", "last_seen", "timers", "started_at", "replay", "bytes_sent", "frames_sent", "_keyframes", "_keyframes_version", "expected", "resume_tokens")
+
+    def __init__(self, match_id, state):
+        self.match_id = match_id
+        self.state = state
+        self.tracker = state.tracker # versioned change log for deltas
+        self.players = {} # player_id: websocket
+        self.pending_moves = {} # player_id: (direction, seq), applied on the next tick (last move wins)
+        self.buckets = {} # player_id: TokenBucket limiting that player's inputs
+        self.input_stats = {} # player_id: {"accepted", "coalesced", "rate_limited"} counts
+        self.tick = 0
+        self.phase = 0 # tick phase slot, offsets this session's ticks within the tick interval
+        self.tick_stats = {"late_max": 0.0, "late_total": 0.0, "overruns": 0, "skipped": 0}
+        self.idle = False # ticking at IDLE_TICK_RATE until the next input
+        self.last_input = 0.0 # event loop time of the last join or move
+        self.wake = asyncio.Event() # set to pull an idle session back to full rate
+        self.started_at = None # event loop time the session started (or was restored)
+        self.ends_at = None # event loop time the match ends, published as time_remaining
+        self.tick_task = None
+        self.acked = {} # player_id: last state version the client acked (None = needs keyframe)
+        self.codecs = {} # player_id: wire codec negotiated in join
+        self.outboxes = {} # player_id: Outbox draining that player's websocket
+        self.last_keyframe_tick = 0
+        self.views = {} # player_id: what that player was sent, with AOI_RADIUS set (see interest.py); kept through the grace window
+        self.last_seen = {} # player_id: event loop time of the player's last input, for idle kicks
+        self.timers = {} # key: pending timers.Timer, e.g. "end", "reap", ("grace", pid), ("idle", pid)
+        self.replay = None # replay.ReplayWriter when REPLAY_DIR is set
+        self.bytes_sent = 0 # bytes queued to this session's players, for /sessions
+        self.frames_sent = 0
+        self._keyframes = {} # codec: encoded keyframe at _keyframes_version
+        self._keyframes_version = None
+        self.resume_tokens = {} # player_id: token from the player's last join_ack, for resuming (see game.py)
+        self.expected = None # usernames the master registered (CONTROL_TOKEN); None lets anyone join
+
+    def keyframe_frames(self):
+        # Encoded-keyframe cache for the current version, filled by
+        # send_to_players; a new version starts an empty cache
+        if self._keyframes_version != self.tracker.version:
+            self._keyframes = {}
+            self._keyframes_version = self.tracker.version
+        return self._keyframes
+
+    def keyframe_message(self):
+        return {"type": "game_state", "version": self.tracker.version, "keyframe": True, "state": self.state}
+
+
+def new_state(board, history=64, time_remaining=60):
+    return GameState(board, StateTracker(history), time_remaining)
@@ -0,0 +1,108 @@
+import math
+import os
+
+import wire
+from board import Board
+import maps
+from delta import StateTracker
+from session import GameState
+
+# Session snapshots for restarts without losing matches in progress.
+#
+# On drain the server writes one file per live match to SNAPSHOT_DIR; the
+# next process to start (or the restarted worker that owns the match) loads
+# and deletes them, and players reconnect to the same match_id. A snapshot
+# is MAGIC followed by one bin1 tagged value (see wire.py):
+#
+#   {"match_id", "map", "cells": {index: code} (cells changed from the map),
+#    "players": {pid: [score, [x, y], seq]}, "time_left", "game_over", "winner",
+#    "last_move_by", "last_direction", "version", "tick",
+#    "expected": [username, ...] or None (the players registered by the master)}
+#
+# Only game state is kept; connections, acks and queues are rebuilt when
+# players rejoin, and every rejoining player starts from a keyframe.
+
+MAGIC = b"GSS1"
+SUFFIX = ".snap"
+
+
+def capture(session, time_left):
+    state = session.state
+    return {
+        "match_id": session.match_id,
+        "map": state.grid.template.name,
+        "cells": dict(state.grid.cells.changes),
+        "players": {pid: [player.score, list(player.position), player.seq] for pid, player in state.players.items()},
+        "time_left": float(time_left),
+        "game_over": state.game_over,
+        "winner": state.winner,
+        "last_move_by": state.last_move_by,
+        "last_direction": state.last_direction,
+        "version": session.tracker.version,
+        "tick": session.tick,
+        "expected": sorted(session.expected) if session.expected is not None else None
+    }
+
+def restore_state(data, history=64):
+    """Rebuild the GameState described by a captured snapshot."""
+    board = Board(maps.get_map(data["map"]))
+    for index, code in data["cells"].items():
+        board.cells[index] = code
+    tracker = StateTracker(history)
+    tracker.version = data["version"] # Versions keep counting up across the restart
+    state = GameState(board, tracker, max(1, math.ceil(data["time_left"])))
+    for pid, (score, position, seq) in data["players"].items():
+        player = state.add_player(pid, tuple(position))
+        player.score = score
+        player.seq = seq
+    state.game_over = data["game_over"]
+    state.winner = data["winner"]
+    state.last_move_by = data["last_move_by"]
+    state.last_direction = data["last_direction"]
+    tracker.pending.clear() # Restored, not changed
+    return state
+
+
+def encode(data):
+    out = bytearray(MAGIC)
+    wire.encode_value(data, out)
+    return bytes(out)
+
+def decode(blob):
+    if not blob.startswith(MAGIC):
+        raise ValueError("Not a session snapshot")
+    data, _ = wire.decode_value(blob, len(MAGIC))
+    return data
+
+def filename(match_id):
+    # match_id comes from the URL path; hex keeps it a safe file name
+    return str(match_id).encode("utf-8").hex() + SUFFIX
+
+
+def write(directory, blobs):
+    # blobs: {match_id: encoded snapshot}. Blocking; run it in a thread.
+    os.makedirs(directory, exist_ok=True)
+    for match_id, blob in blobs.items():
+        path = os.path.join(directory, filename(match_id))
+        with open(path + ".tmp", "wb") as f:
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path) # A reader never sees a partial file
+
+def read(directory, owns=None):
+    """Yield (path, blob) for every snapshot in directory, optionally only matches owns(match_id) accepts."""
+    if not os.path.isdir(directory):
+        return
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(SUFFIX):
+            continue
+        try:
+            match_id = bytes.fromhex(name[:-len(SUFFIX)]).decode("utf-8")
+        except ValueError:
+            continue
+        if owns is not None and not owns(match_id):
+            continue
+        path = os.path.join(directory, name)
+        with open(path, "rb") as f:
+            yield path, f.read()
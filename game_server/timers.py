@@ -0,0 +1,86 @@
+import asyncio
+import heapq
+import itertools
+
+# One heap of deadlines per process for everything that happens "in N
+# seconds": match end, idle kicks, reconnect grace windows, reaping empty
+# sessions. A pending timer is a heap entry and nothing else; only the
+# earliest deadline is armed on the event loop, so thousands of idle
+# sessions cost no wakeups until one of their deadlines is due.
+#
+# Cancelled timers stay in the heap until they reach the top (or until they
+# outnumber the live ones, then the heap is rebuilt).
+
+
+class Timer:
+    __slots__ = ("when", "callback", "args", "cancelled")
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False # set by TimerQueue.cancel() and once fired
+
+
+class TimerQueue:
+    def __init__(self):
+        self.heap = [] # (when, seq, Timer)
+        self.seq = itertools.count() # tie-breaker so equal deadlines fire in order
+        self.cancelled = 0 # cancelled entries still in heap, counted on cancel()
+        self.armed = None # (when, TimerHandle) for the earliest deadline
+        self.fired = 0
+
+    def time(self):
+        return asyncio.get_running_loop().time()
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.time() + delay, callback, *args)
+
+    def call_at(self, when, callback, *args):
+        timer = Timer(when, callback, args)
+        heapq.heappush(self.heap, (when, next(self.seq), timer))
+        if self.armed is None or when < self.armed[0]:
+            self._arm()
+        return timer
+
+    def cancel(self, timer):
+        # No-op for None and for timers that already fired or were cancelled
+        if timer is not None and not timer.cancelled:
+            timer.cancelled = True
+            self.cancelled += 1
+            if self.cancelled > 64 and self.cancelled > len(self.heap) // 2:
+                self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+                heapq.heapify(self.heap)
+                self.cancelled = 0
+
+    def __len__(self):
+        return len(self.heap) - self.cancelled
+
+    def _arm(self):
+        if self.armed is not None:
+            self.armed[1].cancel()
+            self.armed = None
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+            self.cancelled -= 1
+        if self.heap:
+            when = self.heap[0][0]
+            self.armed = (when, asyncio.get_running_loop().call_at(when, self._run))
+
+    def _run(self):
+        self.armed = None
+        now = self.time()
+        while self.heap and self.heap[0][0] <= now:
+            timer = heapq.heappop(self.heap)[2]
+            if timer.cancelled:
+                self.cancelled -= 1
+                continue
+            timer.cancelled = True # fired; a later cancel() is a no-op
+            self.fired += 1
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                # Same reporting as a failing loop.call_at() callback
+                asyncio.get_running_loop().call_exception_handler({
+                    "message": f"Timer callback {timer.callback!r} failed", "exception": e})
+        self._arm()
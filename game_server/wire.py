@@ -0,0 +1,285 @@
+import base64
+import json
+import struct
+
+# Wire codecs for the game server protocol.
+#
+# Every connection starts out speaking JSON text frames. In its "join" message
+# a client may offer {"codecs": ["bin1", "json"]}; the server picks the first
+# one it supports and echoes it back as "codec" in join_ack. With "bin1" the
+# hot messages (move, ack, game_state, player_event) travel as binary frames:
+# a one-byte message type, a fixed struct header and, where needed, a compact
+# tagged value encoding that replaces repeated keys like "position" and
+# "score" with one-byte references. Everything else stays JSON, and decode()
+# accepts either kind of frame regardless of what was negotiated.
+#
+# Objects with a to_wire() method (e.g. the game board) are encoded as the
+# value it returns. bytes go out raw in bin1 and base64 encoded in JSON.
+#
+# client/wire.py and game_server/wire.py are identical copies, so the client
+# runs standalone and the server deploys without the client folder.
+# tests/test_wire.py fails if they differ: edit one, then copy it over.
+
+JSON = "json"
+BINARY = "bin1"
+SUPPORTED = (BINARY, JSON) # In order of preference
+
+def negotiate(offered):
+    if isinstance(offered, list):
+        for codec in SUPPORTED:
+            if codec in offered:
+                return codec
+    return JSON
+
+
+# --- Message layouts -------------------------------------------------------
+
+MSG_MOVE = 1
+MSG_GAME_STATE = 2
+MSG_PLAYER_EVENT = 3
+MSG_ACK = 4
+
+DIRECTIONS = ("up", "down", "left", "right")
+DIRECTION_CODES = {d: i for i, d in enumerate(DIRECTIONS)}
+EVENTS = ("player_joined", "player_left")
+EVENT_CODES = {e: i for i, e in enumerate(EVENTS)}
+
+FLAG_KEYFRAME = 1
+
+_MOVE = struct.Struct("<BB") # type, direction
+_MOVE_SEQ = struct.Struct("<BBI") # type, direction, input sequence number (optional)
+_ACK = struct.Struct("<BI") # type, version
+_STATE = struct.Struct("<BBI") # type, flags, version
+_BASE = struct.Struct("<I") # base version (deltas only)
+_EVENT = struct.Struct("<BB") # type, event
+
+
+def encode(message, codec=JSON):
+    """Encode a message dict as a text (JSON) or binary (bin1) frame."""
+    if codec == BINARY:
+        frame = _encode_binary(message)
+        if frame is not None:
+            return frame
+    return json.dumps(message, default=_json_default)
+
+def _json_default(value):
+    if hasattr(value, "to_wire"):
+        return value.to_wire()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(value).decode("ascii")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def decode(frame):
+    """Decode a text or binary frame into a message dict. Raises ValueError."""
+    if isinstance(frame, (bytes, bytearray, memoryview)):
+        return _decode_binary(bytes(frame))
+    try:
+        return json.loads(frame) # json.JSONDecodeError is a ValueError
+    except RecursionError as e:
+        raise ValueError("JSON nested too deeply") from e
+
+
+def _encode_binary(message):
+    # Returns None for messages bin1 has no layout for; those go as JSON
+    msg_type = message.get("type")
+    if msg_type == "move":
+        code = DIRECTION_CODES.get(message.get("direction"))
+        if code is None:
+            return None
+        seq = message.get("seq")
+        if seq is None:
+            return _MOVE.pack(MSG_MOVE, code)
+        if not isinstance(seq, int) or not 0 <= seq <= 0xffffffff:
+            return None
+        return _MOVE_SEQ.pack(MSG_MOVE, code, seq)
+    if msg_type == "ack":
+        version = message.get("version")
+        if not isinstance(version, int) or version < 0:
+            return None
+        return _ACK.pack(MSG_ACK, version)
+    if msg_type == "game_state":
+        out = bytearray()
+        if message.get("keyframe"):
+            out += _STATE.pack(MSG_GAME_STATE, FLAG_KEYFRAME, message["version"])
+            encode_value(message["state"], out)
+        else:
+            out += _STATE.pack(MSG_GAME_STATE, 0, message["version"])
+            out += _BASE.pack(message["base"])
+            encode_value([message["changes"], message["removed"]], out)
+        return bytes(out)
+    if msg_type == "player_event":
+        code = EVENT_CODES.get(message.get("event"))
+        if code is None:
+            return None
+        out = bytearray(_EVENT.pack(MSG_PLAYER_EVENT, code))
+        encode_value(message["player_id"], out)
+        return bytes(out)
+    return None
+
+def _decode_binary(frame):
+    if not frame:
+        raise ValueError("Empty binary frame")
+    msg_type = frame[0]
+    try:
+        if msg_type == MSG_MOVE:
+            if len(frame) >= _MOVE_SEQ.size:
+                _, code, seq = _MOVE_SEQ.unpack_from(frame)
+                return {"type": "move", "direction": DIRECTIONS[code], "seq": seq}
+            _, code = _MOVE.unpack_from(frame)
+            return {"type": "move", "direction": DIRECTIONS[code]}
+        if msg_type == MSG_ACK:
+            _, version = _ACK.unpack_from(frame)
+            return {"type": "ack", "version": version}
+        if msg_type == MSG_GAME_STATE:
+            _, flags, version = _STATE.unpack_from(frame)
+            offset = _STATE.size
+            if flags & FLAG_KEYFRAME:
+                state, _ = decode_value(frame, offset)
+                return {"type": "game_state", "version": version, "keyframe": True, "state": state}
+            (base,) = _BASE.unpack_from(frame, offset)
+            (changes, removed), _ = decode_value(frame, offset + _BASE.size)
+            return {"type": "game_state", "version": version, "base": base,
+                    "changes": changes, "removed": removed}
+        if msg_type == MSG_PLAYER_EVENT:
+            _, code = _EVENT.unpack_from(frame)
+            player_id, _ = decode_value(frame, _EVENT.size)
+            return {"type": "player_event", "event": EVENTS[code], "player_id": player_id}
+    except (struct.error, IndexError) as e:
+        raise ValueError(f"Malformed binary frame: {e}") from e
+    raise ValueError(f"Unknown binary message type: {msg_type}")
+
+
+# --- Tagged values ---------------------------------------------------------
+# 0x00-0x7f: small non-negative int stored inline
+# 0xc0 None, 0xc1 False, 0xc2 True, 0xc3 int (zigzag varint), 0xc4 float64,
+# 0xc5 str (varint length + utf-8), 0xc6 list (varint count), 0xc7 dict
+# (varint count, then key/value pairs), 0xc8 interned string (one-byte index
+# into KEYS), 0xc9 bytes (varint length)
+
+T_NONE, T_FALSE, T_TRUE, T_INT, T_FLOAT, T_STR, T_LIST, T_DICT, T_KEY, T_BYTES = range(0xc0, 0xca)
+
+# Strings that show up in almost every state frame. Append only: the index is
+# the wire format.
+KEYS = (
+    "grid", "players", "gems", "time_remaining", "game_over", "winner",
+    "score", "position", "last_move_by", "last_direction",
+    "up", "down", "left", "right",
+    "w", "h", "cells", "map",
+    "seq",
+)
+KEY_INDEX = {k: i for i, k in enumerate(KEYS)}
+
+_FLOAT = struct.Struct("<d")
+MAX_DEPTH = 32 # list and dict nesting decode_value() accepts; real frames stay under 8
+
+
+def _write_varint(n, out):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _read_varint(buf, offset):
+    result = shift = 0
+    while True:
+        b = buf[offset]
+        offset += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, offset
+        shift += 7
+
+def encode_value(value, out):
+    if value is None:
+        out.append(T_NONE)
+    elif value is True:
+        out.append(T_TRUE)
+    elif value is False:
+        out.append(T_FALSE)
+    elif isinstance(value, int):
+        if 0 <= value <= 0x7f:
+            out.append(value)
+        else:
+            out.append(T_INT)
+            _write_varint((value << 1) if value >= 0 else ((-value << 1) - 1), out)
+    elif isinstance(value, str):
+        index = KEY_INDEX.get(value)
+        if index is not None:
+            out.append(T_KEY)
+            out.append(index)
+        else:
+            data = value.encode("utf-8")
+            out.append(T_STR)
+            _write_varint(len(data), out)
+            out += data
+    elif isinstance(value, (list, tuple)):
+        out.append(T_LIST)
+        _write_varint(len(value), out)
+        for item in value:
+            encode_value(item, out)
+    elif isinstance(value, dict):
+        out.append(T_DICT)
+        _write_varint(len(value), out)
+        for key, item in value.items():
+            encode_value(key, out)
+            encode_value(item, out)
+    elif isinstance(value, float):
+        out.append(T_FLOAT)
+        out += _FLOAT.pack(value)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(T_BYTES)
+        _write_varint(len(value), out)
+        out += value
+    elif hasattr(value, "to_wire"):
+        encode_value(value.to_wire(), out)
+    else:
+        raise TypeError(f"Cannot encode {type(value).__name__} in bin1")
+
+def decode_value(buf, offset=0, depth=0):
+    """Decode one tagged value from buf at offset. Returns (value, new_offset)."""
+    tag = buf[offset]
+    offset += 1
+    if tag <= 0x7f:
+        return tag, offset
+    if tag == T_KEY:
+        return KEYS[buf[offset]], offset + 1
+    if tag in (T_LIST, T_DICT) and depth >= MAX_DEPTH:
+        raise ValueError("Value nested too deeply")
+    if tag == T_LIST:
+        count, offset = _read_varint(buf, offset)
+        items = []
+        for _ in range(count):
+            item, offset = decode_value(buf, offset, depth + 1)
+            items.append(item)
+        return items, offset
+    if tag == T_DICT:
+        count, offset = _read_varint(buf, offset)
+        result = {}
+        for _ in range(count):
+            key, offset = decode_value(buf, offset, depth + 1)
+            if isinstance(key, (list, dict)):
+                raise ValueError(f"Unhashable dict key: {type(key).__name__}")
+            result[key], offset = decode_value(buf, offset, depth + 1)
+        return result, offset
+    if tag == T_STR:
+        length, offset = _read_varint(buf, offset)
+        if offset + length > len(buf):
+            raise ValueError("Truncated string")
+        return buf[offset:offset + length].decode("utf-8"), offset + length
+    if tag == T_INT:
+        n, offset = _read_varint(buf, offset)
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1), offset
+    if tag == T_NONE:
+        return None, offset
+    if tag == T_TRUE:
+        return True, offset
+    if tag == T_FALSE:
+        return False, offset
+    if tag == T_FLOAT:
+        return _FLOAT.unpack_from(buf, offset)[0], offset + _FLOAT.size
+    if tag == T_BYTES:
+        length, offset = _read_varint(buf, offset)
+        if offset + length > len(buf):
+            raise ValueError("Truncated bytes")
+        return bytes(buf[offset:offset + length]), offset + length
+    raise ValueError(f"Unknown value tag: {tag:#x}")
@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from urllib.parse import urlsplit
+
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "client"))
+import wire
+
+# Headless bot swarm for load testing. Every bot is a simulated player going
+# through the same flow as client/client.py: POST /join to the master, queue
+# on the matchmaking WebSocket until match_found, then join the game server
+# at /game/<match_id> and send moves at a fixed cadence for --duration seconds.
+# All bots run as tasks on one event loop, so one process can drive thousands
+# of them (raise the open file limit, `ulimit -n`, to match).
+#
+#     python game_server/game.py &
+#     python master_server/master.py &
+#     python loadtest/bots.py --bots 1000 --rate 5 --duration 30
+#
+# --direct skips the master and has bots join the game server in groups of
+# --match-size, for load testing a game server on its own. With --workers
+# (GAME_WORKERS) above 1, each match goes to the port of the worker that owns
+# it, as the master would hand out.
+#
+# Reported latencies (percentiles over all bots):
+#   match     join_match sent -> match_found received
+#   join_ack  game join sent -> join_ack received
+#   move      move sent -> first game_state reporting its seq as processed
+#             (the round trip client-side prediction hides, see client.py)
+
+DIRECTIONS = ("up", "down", "left", "right")
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {"match": [], "join_ack": [], "move": []} # seconds
+        self.counts = {"started": 0, "matched": 0, "playing": 0, "finished": 0, "moves_sent": 0,
+                       "states_received": 0, "keyframes_received": 0, "bytes_received": 0}
+        self.errors = {} # kind: count
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def report(self):
+        result = {"counts": self.counts, "errors": self.errors, "latency": {}}
+        for name, values in self.latencies.items():
+            values.sort()
+            result["latency"][name] = {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p90": percentile(values, 90),
+                "p99": percentile(values, 99),
+                "max": values[-1] if values else None
+            }
+        return result
+
+
+def percentile(values, p):
+    # Nearest rank on sorted values
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+def shard_for_match(match_id, workers):
+    # Must stay in sync with shard_for_match() in game_server/game.py
+    return zlib.crc32(str(match_id).encode("utf-8")) % workers
+
+def game_url(args, match_id):
+    # The game server worker that owns match_id
+    port = args.game_port + shard_for_match(match_id, args.workers)
+    return f"ws://{args.host}:{port}/game/{match_id}"
+
+
+async def http_post_json(host, port, path, body, timeout=10):
+    # Minimal HTTP/1.1 client, enough for the master's /join; keeps the load
+    # generator free of an HTTP client dependency
+    data = json.dumps(body).encode("utf-8")
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(f"POST {path} HTTP/1.1\r\nHost: {host}:{port}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("ascii") + data)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    return status, json.loads(payload or b"null")
+
+
+class Bot:
+    def __init__(self, name, args, stats):
+        self.name = name
+        self.args = args
+        self.stats = stats
+        self.seq = 0
+        self.sent = {} # seq: send time, for moves not yet reported processed
+        self.processed = 0 # highest seq the server reported
+
+    async def run(self, match_id=None):
+        stats = self.stats
+        stats.counts["started"] += 1
+        try:
+            if match_id is None:
+                url = await self.find_match()
+            else:
+                url = game_url(self.args, match_id)
+            if url is None:
+                return
+            await self.play(url)
+            stats.counts["finished"] += 1
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+            stats.error(type(e).__name__)
+
+    async def find_match(self):
+        args = self.args
+        status, body = await http_post_json(args.host, args.http_port, "/join", {"username": self.name})
+        if status != 200 or not (body or {}).get("success"):
+            self.stats.error(f"join_http_{status}")
+            return None
+        async with websockets.connect(f"ws://{args.host}:{args.ws_port}", open_timeout=args.timeout) as ws:
+            started = time.perf_counter()
+            await ws.send(json.dumps({"type": "join_match", "username": self.name}))
+            try:
+                return await asyncio.wait_for(self.wait_for_match(ws, started), args.match_timeout)
+            except asyncio.TimeoutError:
+                # e.g. the last few bots when --bots is not a multiple of the match size
+                self.stats.error("match_timeout")
+                return None
+
+    async def wait_for_match(self, ws, started):
+        args = self.args
+        async for message in ws:
+            data = json.loads(message)
+            if data.get("type") == "match_found":
+                self.stats.latencies["match"].append(time.perf_counter() - started)
+                self.stats.counts["matched"] += 1
+                # Like client.py: keep our host, take the worker's port and path
+                advertised = urlsplit(data.get("game_server") or "")
+                if advertised.port and advertised.path:
+                    return f"ws://{args.host}:{advertised.port}{advertised.path}"
+                return game_url(args, data["match_id"])
+            if data.get("type") == "error":
+                self.stats.error("matchmaking_error")
+                return None
+        self.stats.error("matchmaking_closed")
+        return None
+
+    async def play(self, url):
+        args = self.args
+        stats = self.stats
+        async with websockets.connect(url, open_timeout=args.timeout, max_size=None) as ws:
+            started = time.perf_counter()
+            await ws.send(json.dumps({"type": "join", "username": self.name, "codecs": [args.codec]}))
+            ack = json.loads(await asyncio.wait_for(ws.recv(), args.timeout))
+            if ack.get("type") != "join_ack":
+                stats.error("join_rejected")
+                return
+            stats.latencies["join_ack"].append(time.perf_counter() - started)
+            stats.counts["playing"] += 1
+            codec = ack.get("codec", wire.JSON)
+            self.seq = self.processed = ack.get("seq", 0)
+            receiver = asyncio.create_task(self.receive(ws, codec))
+            try:
+                await self.send_moves(ws, codec)
+            finally:
+                receiver.cancel()
+            stats.counts["playing"] -= 1
+
+    async def send_moves(self, ws, codec):
+        args = self.args
+        deadline = time.perf_counter() + args.duration
+        interval = 1 / args.rate if args.rate > 0 else None
+        # Random phase so bots do not all send in the same instant
+        await asyncio.sleep(random.random() * (interval or 0))
+        while time.perf_counter() < deadline:
+            if interval is None:
+                await asyncio.sleep(deadline - time.perf_counter())
+                break
+            self.seq += 1
+            self.sent[self.seq] = time.perf_counter()
+            await ws.send(wire.encode({"type": "move", "direction": random.choice(DIRECTIONS), "seq": self.seq}, codec))
+            self.stats.counts["moves_sent"] += 1
+            await asyncio.sleep(interval * random.uniform(1 - args.jitter, 1 + args.jitter))
+
+    async def receive(self, ws, codec):
+        stats = self.stats
+        try:
+            async for frame in ws:
+                stats.counts["bytes_received"] += len(frame)
+                data = wire.decode(frame)
+                if data.get("type") != "game_state":
+                    continue
+                stats.counts["states_received"] += 1
+                if data.get("keyframe"):
+                    stats.counts["keyframes_received"] += 1
+                    self.processed_up_to(data["state"]["players"].get(self.name, {}).get("seq"))
+                else:
+                    for path, value in data["changes"]:
+                        if len(path) >= 2 and path[0] == "players" and path[1] == self.name:
+                            self.processed_up_to(value if len(path) == 3 and path[2] == "seq"
+                                                 else value.get("seq") if isinstance(value, dict) else None)
+                # Without acks the server would keep sending keyframes
+                await ws.send(wire.encode({"type": "ack", "version": data["version"]}, codec))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def processed_up_to(self, seq):
+        if seq is None or seq <= self.processed:
+            return
+        now = time.perf_counter()
+        latencies = self.stats.latencies["move"]
+        for done in range(self.processed + 1, seq + 1):
+            sent_at = self.sent.pop(done, None)
+            if sent_at is not None:
+                latencies.append(now - sent_at)
+        # Moves the server coalesced away are covered by a later seq; forget them too
+        self.processed = seq
+
+
+async def progress(stats, interval):
+    while True:
+        await asyncio.sleep(interval)
+        counts = stats.counts
+        print(f"[progress] started={counts['started']} matched={counts['matched']} playing={counts['playing']} "
+              f"finished={counts['finished']} moves={counts['moves_sent']} states={counts['states_received']} "
+              f"errors={sum(stats.errors.values())}", flush=True)
+
+
+async def main(args):
+    stats = Stats()
+    reporter = asyncio.create_task(progress(stats, args.progress))
+    run_id = args.run_id or f"{int(time.time()) % 100000}"
+    tasks = []
+    started = time.perf_counter()
+    for i in range(args.bots):
+        bot = Bot(f"bot-{run_id}-{i}", args, stats)
+        match_id = f"load-{run_id}-{i // args.match_size}" if args.direct else None
+        tasks.append(asyncio.create_task(bot.run(match_id)))
+        if args.ramp > 0:
+            await asyncio.sleep(args.ramp / args.bots) # spread bot starts over --ramp seconds
+    await asyncio.gather(*tasks)
+    reporter.cancel()
+    result = stats.report()
+    result["elapsed"] = time.perf_counter() - started
+    result["config"] = {k: v for k, v in vars(args).items() if k != "output"}
+    print_report(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 1 if result["errors"] else 0
+
+def print_report(result):
+    print(f"\n{result['counts']['finished']}/{result['counts']['started']} bots finished "
+          f"in {result['elapsed']:.1f}s")
+    print(f"{'latency (ms)':<12} {'count':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for name, row in result["latency"].items():
+        cells = [f"{row[k] * 1000:9.2f}" if row[k] is not None else f"{'-':>9}" for k in ("p50", "p90", "p99", "max")]
+        print(f"{name:<12} {row['count']:>8} {' '.join(cells)}")
+    counts = result["counts"]
+    print(f"moves sent {counts['moves_sent']}, game_states {counts['states_received']} "
+          f"({counts['keyframes_received']} keyframes), {counts['bytes_received']} bytes received")
+    if result["errors"]:
+        print("errors: " + ", ".join(f"{kind}={count}" for kind, count in sorted(result["errors"].items())))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Drive simulated players through matchmaking and game servers")
+    parser.add_argument("--bots", type=int, default=100, help="number of simulated players")
+    parser.add_argument("--rate", type=float, default=5, help="moves per second per bot (0: join and idle)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="random +/- fraction applied to each move interval")
+    parser.add_argument("--duration", type=float, default=30, help="seconds each bot plays once in a match")
+    parser.add_argument("--ramp", type=float, default=10, help="seconds over which bots are started")
+    parser.add_argument("--codec", choices=list(wire.SUPPORTED), default=wire.BINARY)
+    parser.add_argument("--host", default=os.environ.get("SERVER_HOST", "localhost"))
+    parser.add_argument("--http-port", type=int, default=int(os.environ.get("SERVER_HTTP_PORT", 5000)))
+    parser.add_argument("--ws-port", type=int, default=int(os.environ.get("SERVER_WS_PORT", 8765)))
+    parser.add_argument("--game-port", type=int, default=int(os.environ.get("GAME_SERVER_PORT", 9001)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("GAME_WORKERS", 1)),
+                        help="game server worker processes; worker i listens on --game-port + i")
+    parser.add_argument("--direct", action="store_true", help="skip the master and join the game server directly")
+    parser.add_argument("--match-size", type=int, default=4, help="bots per match with --direct")
+    parser.add_argument("--timeout", type=float, default=30, help="connect and join_ack timeout in seconds")
+    parser.add_argument("--match-timeout", type=float, default=60, help="seconds a bot waits in matchmaking")
+    parser.add_argument("--progress", type=float, default=5, help="seconds between progress lines")
+    parser.add_argument("--run-id", help="prefix for bot names and match IDs (default: derived from the time)")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import logging
+
+import websockets
+
+# The master's end of a game server worker's control channel (CONTROL_TOKEN,
+# see handle_control() in game_server/game.py for the messages). One link per
+# worker stays connected, reconnecting with backoff, so registering a match
+# costs one round trip on an open connection. The worker's last reported
+# headroom tells the master whether to place new matches there at all.
+
+logger = logging.getLogger("master")
+
+
+class RegistrationError(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class GameServerLink:
+    def __init__(self, url, token, on_result, timeout=5):
+        self.url = url
+        self.token = token
+        self.on_result = on_result # called with each match_result message
+        self.timeout = timeout # seconds to wait for a registration reply
+        self.websocket = None # set while connected and authenticated
+        self.pending = {} # match_id: future for its registration reply
+        self.headroom = None # last {"sessions", "connections", "draining"} the worker reported
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        delay = 1
+        while True:
+            try:
+                async with websockets.connect(self.url) as websocket:
+                    await websocket.send(json.dumps({"type": "hello", "token": self.token}))
+                    hello = json.loads(await asyncio.wait_for(websocket.recv(), self.timeout))
+                    if hello.get("type") != "hello_ack":
+                        raise ValueError(f"unexpected reply {hello.get('type')!r}")
+                    logger.info("Control link to %s up (worker %s, %s ticks/s)", self.url, hello.get("worker"),
+                                hello.get("tick_rate"))
+                    self.websocket = websocket
+                    self.headroom = hello.get("headroom")
+                    delay = 1
+                    async for message in websocket:
+                        self.dispatch(json.loads(message))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Control link to %s down: %s", self.url, e)
+            finally:
+                self.websocket = None
+                for future in self.pending.values():
+                    if not future.done():
+                        future.set_exception(RegistrationError("disconnected"))
+                self.pending.clear()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def has_room(self, players):
+        # Connected and, as last reported, not draining, with a session free
+        # and connections for all `players`
+        if self.websocket is None:
+            return False
+        headroom = self.headroom or {}
+        sessions = headroom.get("sessions")
+        connections = headroom.get("connections")
+        return (not headroom.get("draining") and (sessions is None or sessions > 0)
+                and (connections is None or connections >= players))
+
+    def dispatch(self, data):
+        kind = data.get("type")
+        if "headroom" in data:
+            self.headroom = data["headroom"]
+        if kind == "capacity":
+            return
+        if kind in ("match_registered", "match_rejected"):
+            future = self.pending.pop(data.get("match_id"), None)
+            if future is None or future.done():
+                return
+            if kind == "match_registered":
+                future.set_result(None)
+            else:
+                future.set_exception(RegistrationError(data.get("reason", "rejected")))
+        elif kind == "match_result":
+            self.on_result(data)
+        else:
+            logger.warning("Unknown control message from %s: %s", self.url, kind)
+
+    async def register(self, match_id, players, map_name=None, tick_rate=None):
+        """Pre-register a match. Raises RegistrationError if the game server did not accept it."""
+        if self.websocket is None:
+            raise RegistrationError("unavailable")
+        if match_id in self.pending:
+            raise RegistrationError("in_progress")
+        future = self.pending[match_id] = asyncio.get_running_loop().create_future()
+        try:
+            await self.websocket.send(json.dumps({"type": "register_match", "match_id": match_id,
+                                                  "players": players, "map": map_name, "tick_rate": tick_rate}))
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise RegistrationError("timeout")
+        except websockets.ConnectionClosed:
+            raise RegistrationError("disconnected")
+        finally:
+            if self.pending.get(match_id) is future:
+                del self.pending[match_id]
@@ -1,12 +1,18 @@
 import asyncio
 import websockets
 import json
+import logging
+import logging.handlers
+import queue
 import threading
 import uuid
+from collections import OrderedDict
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
+import zlib
 from websockets.server import serve  # Updated import path
+from game_link import GameServerLink, RegistrationError
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -16,6 +22,19 @@ HOST = "0.0.0.0"  # Allow external connections
 HTTP_PORT = int(os.environ.get("PORT", 5000))  # For cloud platforms that set their own port
 MATCHMAKING_PORT = int(os.environ.get("WS_PORT", 8765))
 GAME_SERVER_PORT = int(os.environ.get("GAME_PORT", 9001))
+# Number of game server worker processes (game.py GAME_WORKERS). Worker i
+# listens on GAME_PORT + i and owns the matches shard_for_match() assigns it.
+GAME_WORKERS = int(os.environ.get("GAME_WORKERS", 1))
+# With CONTROL_TOKEN set (the same token as the game server's) the master
+# keeps a control connection to every game worker on GAME_HOST, registers
+# each match there before sending match_found, and records the results the
+# game server reports. MATCH_MAP and MATCH_TICK_RATE go with each
+# registration; empty/0 leaves them to the game server.
+CONTROL_TOKEN = os.environ.get("CONTROL_TOKEN")
+GAME_HOST = os.environ.get("GAME_HOST", "localhost")
+MATCH_MAP = os.environ.get("MATCH_MAP") or None
+MATCH_TICK_RATE = int(os.environ.get("MATCH_TICK_RATE", 0)) or None
+MAX_MATCH_RESULTS = 1000 # most recent match results kept for /matches/<match_id>
 
 # Get the public IP or domain name from environment variable
 PUBLIC_HOST = os.environ.get("PUBLIC_HOST", HOST)
@@ -24,15 +43,32 @@ GAME_SERVER_WS_URL = f"ws://{PUBLIC_HOST}:{GAME_SERVER_PORT}/game/"
 
 MAX_PLAYERS_PER_MATCH = 4
 
+# Logging goes through a queue to a background writer thread (see
+# setup_logging); per-player matchmaking events are DEBUG and off by default.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+logger = logging.getLogger("master")
+dropped_log_records = 0 # Records dropped because the log queue was full, reported by /health
+
 # Store rooms and their players
 rooms = {}  # room_code -> {players: [(websocket, username)], host: username}
 matchmaking_queue = []  # For players not specifying a room code
 next_match_id = 1
 active_connections = {}  # websocket -> (username, room_code)
+game_links = []  # GameServerLink per game worker, when CONTROL_TOKEN is set
+match_results = OrderedDict()  # match_id -> match_result reported by the game server
 
 @app.route("/health", methods=["GET"])
 def health_check():
-    return jsonify({"status": "ok"}), 200
+    return jsonify({"status": "ok", "log_records_dropped": dropped_log_records}), 200
+
+@app.route("/matches/<match_id>", methods=["GET"])
+def match_result(match_id):
+    # Final scores of a finished match, as reported by the game server (CONTROL_TOKEN)
+    result = match_results.get(match_id)
+    if result is None:
+        return jsonify({"success": False, "message": "No result for this match"}), 404
+    return jsonify({"success": True, "match_id": match_id, "winner": result.get("winner"),
+                    "scores": result.get("scores", {})}), 200
 
 @app.route("/join", methods=["POST"])
 def join():
@@ -50,7 +86,7 @@ def join():
 
         return jsonify({"success": True, "message": "Join successful"})
     except Exception as e:
-        print(f"Error in /join endpoint: {str(e)}")
+        logger.exception("Error in /join endpoint: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route("/create_room", methods=["POST"])
@@ -78,7 +114,7 @@ def create_room():
             "room_code": room_code
         })
     except Exception as e:
-        print(f"Error in /create_room endpoint: {str(e)}")
+        logger.exception("Error in /create_room endpoint: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 async def matchmaking_handler(websocket):
@@ -189,7 +225,7 @@ async def matchmaking_handler(websocket):
 
                 else:
                     # Join general matchmaking queue
-                    print(f"{username} joined matchmaking queue.")
+                    logger.debug("%s joined matchmaking queue", username)
                     matchmaking_queue.append((websocket, username))
                     active_connections[websocket] = (username, None)
 
@@ -263,10 +299,10 @@ async def matchmaking_handler(websocket):
                 await start_match(match_id, players, host)
 
     except websockets.ConnectionClosed:
-        print("WebSocket client disconnected.")
+        logger.debug("WebSocket client disconnected")
         await handle_disconnect(websocket)
     except Exception as e:
-        print(f"Error in matchmaking handler: {str(e)}")
+        logger.exception("Error in matchmaking handler: %s", e)
         await handle_disconnect(websocket)
 
 async def handle_disconnect(websocket):
@@ -327,12 +363,62 @@ async def handle_disconnect(websocket):
                         pass
                 break
 
+def shard_for_match(match_id, workers):
+    # Must stay in sync with shard_for_match() in game_server/game.py
+    return zlib.crc32(str(match_id).encode("utf-8")) % workers
+
+def game_server_url(match_id):
+    # URL of the game server worker that owns this match
+    port = GAME_SERVER_PORT + shard_for_match(match_id, GAME_WORKERS)
+    return f"ws://{PUBLIC_HOST}:{port}/game/{match_id}"
+
+async def register_match(match_id, player_names):
+    # Pre-registers the match with the game worker that owns it and returns
+    # the match_id it was registered under, or None. The worker is picked by
+    # the match_id's hash, so a full, draining or unreachable worker (or an
+    # ID still live there, e.g. from before a master restart) is skipped by
+    # moving on to the next match_id.
+    global next_match_id
+    for attempt in range(2 * GAME_WORKERS + 1):
+        link = game_links[shard_for_match(match_id, GAME_WORKERS)]
+        if link.has_room(len(player_names)):
+            try:
+                await link.register(str(match_id), player_names, MATCH_MAP, MATCH_TICK_RATE)
+                return match_id
+            except RegistrationError as e:
+                logger.warning("Match %s not registered with %s: %s", match_id, link.url, e.reason)
+                if e.reason in ("invalid", "unknown_map", "tick_rate"): # Same answer from any worker
+                    return None
+        match_id = next_match_id
+        next_match_id += 1
+    return None
+
+def record_result(data):
+    # match_result from a game server's control channel
+    match_results[str(data.get("match_id"))] = data
+    while len(match_results) > MAX_MATCH_RESULTS:
+        match_results.popitem(last=False)
+    logger.info("Match %s finished, winner %s", data.get("match_id"), data.get("winner"))
+
 async def start_match(match_id, players, host):
     player_names = [uname for _, uname in players]
+
+    if game_links:
+        match_id = await register_match(match_id, player_names)
+        if match_id is None:
+            for ws, _ in players:
+                try:
+                    await ws.send(json.dumps({
+                        "type": "error",
+                        "message": "No game server could take the match, please try again"
+                    }))
+                except:
+                    pass
+            return
     
     match_info = {
         "match_id": match_id,
-        "game_server": f"{GAME_SERVER_WS_URL}{match_id}",
+        "game_server": game_server_url(match_id),
         "players": player_names,
         "host": host
     }
@@ -354,13 +440,15 @@ def start_websocket_server():
     asyncio.set_event_loop(loop)
     
     async def start_server():
-<<<<<<< HEAD
-        async with websockets.serve(matchmaking_handler, "0.0.0.0", MATCHMAKING_PORT) as server:
-=======
+        if CONTROL_TOKEN:
+            for index in range(GAME_WORKERS):
+                link = GameServerLink(f"ws://{GAME_HOST}:{GAME_SERVER_PORT + index}/control", CONTROL_TOKEN,
+                                      record_result)
+                game_links.append(link)
+                link.start()
         # Use the imported serve function
         async with serve(matchmaking_handler, "0.0.0.0", MATCHMAKING_PORT) as server:
->>>>>>> 1c9a33f (reverting changes)
-            print(f"Matchmaking WebSocket running on {MATCHMAKING_WS_URL}")
+            logger.info("Matchmaking WebSocket running on %s", MATCHMAKING_WS_URL)
             await asyncio.Future()  # run forever
     
     try:
@@ -369,16 +457,54 @@ def start_websocket_server():
         loop.close()
 
 def start_flask_server():
-    print(f"Flask REST API running on http://{HOST}:{HTTP_PORT}")
+    logger.info("Flask REST API running on http://%s:%s", HOST, HTTP_PORT)
     app.run(host="0.0.0.0", port=5000)
 
 
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # The stock QueueHandler formats the message in the calling thread and
+    # reports a full queue through handleError (a traceback on stderr). This
+    # one only renders tracebacks, which cannot cross threads, and drops and
+    # counts records the listener cannot keep up with (as game_server/log.py)
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global dropped_log_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_log_records += 1
+
+
+def setup_logging():
+    # Records are queued by the request/matchmaking threads and formatted and
+    # written by the listener thread, keeping formatting and stdout writes off
+    # the hot path
+    records = queue.Queue(maxsize=10000)
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s %(name)s %(message)s"))
+    listener = logging.handlers.QueueListener(records, stream, respect_handler_level=False)
+    listener.start()
+    root = logging.getLogger()
+    root.addHandler(_DeferredQueueHandler(records))
+    root.setLevel(LOG_LEVEL)
+    return listener
+
+
 if __name__ == "__main__":
+    setup_logging()
     # Print server information
-    print(f"Starting master server...")
-    print(f"HTTP API will be available at: http://{PUBLIC_HOST}:{HTTP_PORT}")
-    print(f"WebSocket server will be available at: {MATCHMAKING_WS_URL}")
-    print(f"Game server will be available at: {GAME_SERVER_WS_URL}")
+    logger.info("Starting master server...")
+    logger.info("HTTP API will be available at: http://%s:%s", PUBLIC_HOST, HTTP_PORT)
+    logger.info("WebSocket server will be available at: %s", MATCHMAKING_WS_URL)
+    logger.info("Game server will be available at: %s", GAME_SERVER_WS_URL)
+    if GAME_WORKERS > 1:
+        logger.info("Matches are sharded across %d game workers on ports %d-%d",
+                    GAME_WORKERS, GAME_SERVER_PORT, GAME_SERVER_PORT + GAME_WORKERS - 1)
     
     threading.Thread(target=start_websocket_server, daemon=True).start()
     start_flask_server()
\ No newline at end of file
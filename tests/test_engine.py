@@ -0,0 +1,104 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "game_server"))
+from board import Board
+import engine
+import maps
+import rules
+from session import GameSession, new_state
+
+# BatchEngine.step() must leave every session exactly as rules.move() applied
+# to its pending moves in input order would, or replays diverge. Crowded
+# boards make the interacting cases common: moves into occupied cells, two
+# moves into one cell and moves out of a cell another move targets.
+
+TRIALS = 30
+TICKS = 25
+
+maps.register_map(maps.generate_map("engine-crowded", 6, 6, gem_density=0.3, walls=True, seed=5))
+maps.register_map(maps.generate_map("engine-open", 24, 24, gem_density=0.1, walls=True, seed=6))
+
+
+def make_session(match_id, map_name, players):
+    state = new_state(Board(maps.get_map(map_name)))
+    for i in range(players):
+        state.add_player(f"p{i}", rules.spawn_position(state))
+    state.tracker.commit()
+    return GameSession(match_id, state)
+
+def snapshot(state):
+    board = state.grid
+    return {
+        "players": {pid: (player.position, player.score) for pid, player in state.players.items()},
+        "cells": board.cells.tobytes(),
+        "occupants": dict(state.occupants),
+        "last_move_by": state.last_move_by,
+        "last_direction": state.last_direction,
+        "touched": set(state.tracker.pending),
+    }
+
+def random_moves(rng, state):
+    moves = {}
+    for pid in state.players:
+        if rng.random() < 0.8:
+            moves[pid] = (rng.choice(list(rules.MOVES)), None)
+    if rng.random() < 0.1:
+        moves["gone"] = ("up", None) # left before the tick
+    if rng.random() < 0.1:
+        moves[rng.choice(list(state.players))] = (rng.choice(["jump", ["up"], {"up": 1}]), None)
+    return moves
+
+
+@unittest.skipUnless(engine.available(), "numpy is not installed")
+class BatchEngineTest(unittest.TestCase):
+    def check(self, map_name, seed):
+        rng = random.Random(seed)
+        batch = engine.BatchEngine(capacity=64) # small, so attach() has to grow it
+        sessions = []
+        for i in range(rng.randrange(1, 6)):
+            players = rng.randrange(1, 12)
+            expected = make_session(f"m{i}", map_name, players)
+            actual = make_session(f"m{i}", map_name, players)
+            batch.attach(actual.state)
+            sessions.append((expected, actual))
+
+        for tick in range(TICKS):
+            for expected, actual in sessions:
+                moves = random_moves(rng, expected.state)
+                expected.pending_moves = moves
+                actual.pending_moves = dict(moves)
+                for pid, (direction, _) in moves.items():
+                    rules.move(expected.state, pid, direction)
+            batch.step([actual for _, actual in sessions])
+
+            for expected, actual in sessions:
+                where = f"{map_name} seed {seed} tick {tick} {actual.match_id}"
+                self.assertEqual(snapshot(actual.state), snapshot(expected.state), where)
+                # The shared arrays must keep mirroring the board and occupancy
+                block = actual.state.batch
+                board = actual.state.grid
+                self.assertEqual(batch.cells[block.offset:block.offset + block.size].tobytes(),
+                                 board.cells.tobytes(), where)
+                occupied = bytes(1 if (x, y) in actual.state.occupants else 0
+                                 for y in range(board.height) for x in range(board.width))
+                self.assertEqual(batch.occupied[block.offset:block.offset + block.size].tobytes(), occupied, where)
+                expected.tracker.commit()
+                actual.tracker.commit()
+
+        for _, actual in sessions:
+            batch.detach(actual.state)
+
+    def test_crowded_board(self):
+        for seed in range(TRIALS):
+            self.check("engine-crowded", seed)
+
+    def test_open_board(self):
+        for seed in range(TRIALS):
+            self.check("engine-open", seed)
+
+
+if __name__ == "__main__":
+    unittest.main()
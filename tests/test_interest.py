@@ -0,0 +1,122 @@
+import base64
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "game_server"))
+from board import Board
+import interest
+import maps
+import rules
+import wire
+from session import GameSession, new_state
+
+# Round trips AOI frames through a simulated client: every frame is encoded,
+# decoded and applied the way client/client.py applies them, while acks reach
+# the server a few ticks late. After every tick the players and window cells
+# the client holds must equal the server state filtered to its view.
+
+RADIUS = 3
+PLAYERS = 10
+TICKS = 300
+MAX_ACK_DELAY = 4 # ticks
+
+maps.register_map(maps.generate_map("aoi-test", 20, 20, gem_density=0.2, walls=True, seed=3))
+
+
+def set_path(state, path, value, remove=False):
+    key, rest = path[0], path[1:]
+    if rest:
+        set_path(state[key], rest, value, remove)
+    elif remove:
+        if isinstance(state, dict):
+            state.pop(key, None)
+    else:
+        state[key] = value
+
+
+class Client:
+    def __init__(self, player_id):
+        self.player_id = player_id
+        self.version = None
+        self.state = None
+
+    def apply(self, message):
+        if message.get("keyframe"):
+            self.state = message["state"]
+            cells = self.state["grid"]["cells"]
+            if isinstance(cells, str):
+                cells = base64.b64decode(cells)
+            self.state["grid"]["cells"] = bytearray(cells)
+        else:
+            assert self.version is not None and message["base"] <= self.version
+            for path, value in message["changes"]:
+                set_path(self.state, path, value)
+            for path in message["removed"]:
+                set_path(self.state, path, None, remove=True)
+        self.version = message["version"]
+
+
+def wire_player(player):
+    record = player.to_wire()
+    record["position"] = list(record["position"])
+    return record
+
+
+class StateMessageRoundTripTest(unittest.TestCase):
+    def run_match(self, codec, seed):
+        rng = random.Random(seed)
+        state = new_state(Board(maps.get_map("aoi-test")), history=64)
+        session = GameSession("aoi-test", state)
+        player_ids = [f"p{i}" for i in range(PLAYERS)]
+        for pid in player_ids:
+            state.add_player(pid, rules.spawn_position(state))
+        state.tracker.commit()
+        clients = {pid: Client(pid) for pid in player_ids}
+        views = {pid: {} for pid in player_ids}
+        acked = {pid: None for pid in player_ids}
+        in_flight = [] # (tick the ack arrives, player_id, version)
+
+        for tick in range(TICKS):
+            for pid in player_ids:
+                if rng.random() < 0.8:
+                    rules.move(state, pid, rng.choice(list(rules.MOVES)))
+            state.tracker.commit()
+
+            for arrival, pid, version in [ack for ack in in_flight if ack[0] <= tick]:
+                in_flight.remove((arrival, pid, version))
+                if acked[pid] is None or version > acked[pid]:
+                    acked[pid] = version
+
+            deltas = {}
+            for pid in player_ids:
+                message = interest.state_message(session, views[pid], pid, acked[pid], RADIUS, deltas)
+                if message is None:
+                    continue
+                client = clients[pid]
+                client.apply(wire.decode(wire.encode(message, codec)))
+                in_flight.append((tick + rng.randint(0, MAX_ACK_DELAY), pid, client.version))
+
+            for pid, client in clients.items():
+                position, players = interest.visible(state, pid, RADIUS)
+                expected = {other: wire_player(state.players[other]) for other in players}
+                self.assertEqual(client.state["players"], expected, f"{pid} at tick {tick}")
+                x0, y0, x1, y1 = interest.window(state.grid, position, RADIUS)
+                width = state.grid.width
+                for y in range(y0, y1 + 1):
+                    for x in range(x0, x1 + 1):
+                        self.assertEqual(client.state["grid"]["cells"][y * width + x],
+                                         state.grid.cells[y * width + x], f"{pid} cell {(x, y)} at tick {tick}")
+
+    def test_json_delayed_acks(self):
+        for seed in range(3):
+            self.run_match(wire.JSON, seed)
+
+    def test_binary_delayed_acks(self):
+        for seed in range(3):
+            self.run_match(wire.BINARY, seed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "game_server"))
+import wire
+
+# The wire codecs ship twice: client/wire.py with the standalone client and
+# game_server/wire.py with the server. Both sides must speak the same format.
+
+
+class WireCopiesTest(unittest.TestCase):
+    def test_copies_identical(self):
+        with open(os.path.join(ROOT, "client", "wire.py"), "rb") as f:
+            client = f.read()
+        with open(os.path.join(ROOT, "game_server", "wire.py"), "rb") as f:
+            server = f.read()
+        self.assertEqual(client, server, "client/wire.py and game_server/wire.py differ; copy one over the other")
+
+
+class MalformedFrameTest(unittest.TestCase):
+    # handle_player only expects ValueError from decode(); anything else is
+    # logged as a handler error with a traceback, on any client's say-so
+    STATE = b"\x02\x01\x00\x00\x00\x00" # bin1 game_state keyframe header, version 0
+
+    def assertRejected(self, frame):
+        with self.assertRaises(ValueError):
+            wire.decode(frame)
+
+    def test_unhashable_key(self):
+        self.assertRejected(self.STATE + b"\xc7\x01\xc6\x00\x00")
+        self.assertRejected(self.STATE + b"\xc7\x01\xc7\x00\x00")
+
+    def test_deep_nesting(self):
+        self.assertRejected(self.STATE + b"\xc6\x01" * 5000 + b"\x00")
+        self.assertRejected("[" * 20000 + "]" * 20000)
+
+    def test_truncated(self):
+        self.assertRejected(self.STATE + b"\xc5\x05ab")
+        self.assertRejected(self.STATE + b"\xc6\x03\x00")
+        self.assertRejected(b"\x01")
+
+
+if __name__ == "__main__":
+    unittest.main()